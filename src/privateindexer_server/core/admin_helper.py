@@ -1,67 +1,156 @@
 import os
+import time
 
 import bcrypt
 
 from privateindexer_server.core import logger
-from privateindexer_server.core.config import ADMIN_PASSWORD_FILE
+from privateindexer_server.core.config import ADMIN_PASSWORD_FILE, ADMIN_BCRYPT_COST
 
+# bcrypt 4+ is backed by a native Rust implementation
+if int(bcrypt.__version__.split(".")[0]) < 4:
+    logger.channel("admin").warning(f"Outdated bcrypt v{bcrypt.__version__} installed, admin password hashing will be slow")
 
-def get_admin_password() -> str | None:
+# bcrypt only accepts passwords up to 72 bytes
+BCRYPT_MAX_PASSWORD_BYTES = 72
+
+# hash used to spend equal time on login attempts when no admin password is stored, created after the configured cost has been validated
+_dummy_hash: bytes | None = None
+
+_cached_hash: bytes | None = None
+_cache_loaded = False
+_password_set: bool = os.path.exists(ADMIN_PASSWORD_FILE)
+
+
+def is_password_set() -> bool:
+    """
+    Helper to check if an admin password has been configured without touching the disk
+    """
+    return _password_set
+
+
+def _load_admin_password() -> bytes:
+    """
+    Helper to read the raw password hash from file without a buffered file object
+    """
+    fd = os.open(ADMIN_PASSWORD_FILE, os.O_RDONLY)
+    try:
+        return os.read(fd, 128)
+    finally:
+        os.close(fd)
+
+
+def get_admin_password() -> bytes | None:
     """
     Helper to get password hash from file if exists
+    Hash is cached in memory after the first successful read
     """
-    # return nothing if file doesn't exist
-    if not os.path.exists(ADMIN_PASSWORD_FILE):
-        return None
+    global _cached_hash, _cache_loaded
+
+    # check if hash is cached
+    if _cache_loaded:
+        return _cached_hash
 
     # if file does exist, try to read the key
     try:
-        with open(ADMIN_PASSWORD_FILE, "r") as f:
-            return f.read()
+        _cached_hash = _load_admin_password()
+        _cache_loaded = True
+    except FileNotFoundError:
+        # return nothing if file doesn't exist
+        return None
     except Exception as e:
         logger.channel("admin").exception(f"Exception while loading admin.password: {e}")
         return None
 
+    return _cached_hash
+
+
+def _get_dummy_hash() -> bytes:
+    """
+    Helper to get the dummy hash, creating it on first use
+    """
+    global _dummy_hash
+
+    if _dummy_hash is None:
+        _dummy_hash = bcrypt.hashpw(b"privateindexer-benchmark", bcrypt.gensalt(rounds=ADMIN_BCRYPT_COST))
+
+    return _dummy_hash
+
+
+def benchmark_bcrypt_cost() -> float:
+    """
+    Helper to measure the time of one bcrypt hash at the configured cost so operators can tune it per host
+    """
+    global _dummy_hash
+
+    # the benchmark hash doubles as the dummy hash for login attempts
+    before = time.perf_counter()
+    _dummy_hash = bcrypt.hashpw(b"privateindexer-benchmark", bcrypt.gensalt(rounds=ADMIN_BCRYPT_COST))
+    duration = (time.perf_counter() - before) * 1000
+
+    logger.channel("admin").info(f"Admin password bcrypt cost {ADMIN_BCRYPT_COST} takes {duration:.0f} ms per hash")
+
+    return duration
+
 
 def verify_admin_password(admin_password: str) -> bool:
     """
     Helper to check for admin password match with configured admin password
     """
+    # reject passwords which could never have been stored
+    password_bytes = admin_password.encode()
+    if len(password_bytes) > BCRYPT_MAX_PASSWORD_BYTES:
+        return False
+
     # get the stored admin password
     stored_admin_password = get_admin_password()
 
-    return bcrypt.checkpw(admin_password.encode(), stored_admin_password.encode())
+    # check against a dummy hash if no password is stored to keep the response time uniform
+    if stored_admin_password is None:
+        bcrypt.checkpw(password_bytes, _get_dummy_hash())
+        return False
+
+    return bcrypt.checkpw(password_bytes, stored_admin_password)
 
 
 def set_admin_password(admin_password: str) -> bool:
     """
     Helper to save the admin password to file
     """
-    # require at least twelve characters in length
-    if len(admin_password) < 12:
-        return False
-
-    # require at least one lowercase letter
-    if sum(1 for c in admin_password if c.islower()) < 1:
-        return False
+    global _cached_hash, _cache_loaded, _password_set
 
-    # require at least one capital letter
-    if sum(1 for c in admin_password if c.isupper()) < 1:
+    # require at least twelve characters in length and no more than the 72 bytes bcrypt can hash
+    password_bytes = admin_password.encode()
+    if len(admin_password) < 12 or len(password_bytes) > BCRYPT_MAX_PASSWORD_BYTES:
         return False
 
-    # require at least one number
-    if sum(1 for c in admin_password if c.isnumeric()) < 1:
+    # require at least one lowercase letter, one capital letter, and one number in a single pass
+    has_lower = has_upper = has_number = False
+    for c in admin_password:
+        if c.islower():
+            has_lower = True
+        elif c.isupper():
+            has_upper = True
+        elif c.isnumeric():
+            has_number = True
+
+        if has_lower and has_upper and has_number:
+            break
+    else:
         return False
 
     # use bcrypt for secure hashing
-    hashed_password = bcrypt.hashpw(admin_password.encode(), bcrypt.gensalt())
-    hashed_password = hashed_password.decode()
+    hashed_password = bcrypt.hashpw(password_bytes, bcrypt.gensalt(rounds=ADMIN_BCRYPT_COST))
 
     # save password hash to file
     try:
-        with open(ADMIN_PASSWORD_FILE, "w") as f:
+        with open(ADMIN_PASSWORD_FILE, "wb") as f:
             f.write(hashed_password)
     except Exception as e:
         logger.channel("admin").exception(f"Exception while saving admin.password: {e}")
 
+    # update the cached hash
+    _cached_hash = hashed_password
+    _cache_loaded = True
+    _password_set = True
+
     return True
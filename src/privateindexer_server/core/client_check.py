@@ -1,8 +1,7 @@
 import asyncio
 import datetime
-import socket
 
-from privateindexer_server.core import mysql
+from privateindexer_server.core import mysql, utils
 from privateindexer_server.core.config import CLIENT_CHECK_INTERVAL
 from privateindexer_server.core import logger
 
@@ -37,18 +36,15 @@ async def check_clients():
         # split last_ip text for IP and port
         ip_address, port = last_ip.rsplit(":", 1)
 
-        new_status = 0
-
-        # try to connect to client
-        try:
-            with socket.create_connection((ip_address, port), timeout=5):
-                reachable += 1
-                new_status = 1
-                logger.channel("client-check").debug(f"User is reachable: {user_id}")
-        except (socket.timeout, ConnectionRefusedError, OSError):
-            logger.channel("client-check").debug(f"User is unreachable: {user_id}")
+        # try to connect to client without blocking the event loop
+        if await utils.check_reachable(ip_address, int(port)):
+            reachable += 1
+            new_status = 1
+            logger.channel("client-check").debug(f"User is reachable: {user_id}")
+        else:
             unreachable += 1
-            pass
+            new_status = 0
+            logger.channel("client-check").debug(f"User is unreachable: {user_id}")
 
         # update status in database if necessary
         if new_status != last_status:
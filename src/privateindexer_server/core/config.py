@@ -13,6 +13,8 @@ JWT_KEY_FILE = os.path.join(DATA_DIR, "jwt.key")
 ADMIN_PASSWORD_FILE = os.path.join(DATA_DIR, "admin.password")
 
 CATEGORIES = [{"id": 2000, "name": "Movies"}, {"id": 5000, "name": "TV"}, {"id": 3000, "name": "Audio"}]
+CATEGORY_IDS = frozenset(category["id"] for category in CATEGORIES)
+CATEGORY_NAMES = {category["id"]: category["name"] for category in CATEGORIES}
 
 EXTERNAL_SERVER_URL = (os.getenv("EXTERNAL_SERVER_URL", "")).strip("/")
 
@@ -21,6 +23,8 @@ PEER_TIMEOUT = int(os.getenv("PEER_TIMEOUT", 1800))
 
 STATS_UPDATE_INTERVAL = int(os.getenv("STATS_UPDATE_INTERVAL", 30))
 
+GRAB_FLUSH_INTERVAL = int(os.getenv("GRAB_FLUSH_INTERVAL", 30))
+
 HIGH_LATECY_THRESHOLD = int(os.getenv("HIGH_LATECY_THRESHOLD", 250))
 
 DATABASE_CHECK_INTERVAL = 60 * 60 * int(os.getenv("DATABASE_CHECK_INTERVAL", 12))
@@ -31,12 +35,19 @@ STALE_CHECK_INTERVAL = 60 * 60 * int(os.getenv("STALE_CHECK_INTERVAL", 6))
 STALE_THRESHOLD = 60 * 60 * 24 * int(os.getenv("STALE_THRESHOLD", 30))
 
 SYNC_BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", 5000))
+SYNC_CONCURRENCY = int(os.getenv("SYNC_CONCURRENCY", 4))
+
+RSS_CACHE_TTL = int(os.getenv("RSS_CACHE_TTL", 30))
 
 ACCESS_TOKEN_EXPIRATION = int(os.getenv("ACCESS_TOKEN_EXPIRATION", 10))
 
+# bcrypt work factor is exponential: each step doubles admin login time
+ADMIN_BCRYPT_COST = int(os.getenv("ADMIN_BCRYPT_COST", 11))
+
 SITE_NAME = os.getenv("SITE_NAME", "HumeHouse PrivateIndexer")
 
 REDIS_HOST = os.getenv("REDIS_HOST")
+REDIS_SCAN_COUNT = int(os.getenv("REDIS_SCAN_COUNT", 10000))
 
 MYSQL_HOST = os.getenv("MYSQL_HOST")
 MYSQL_PORT = int(os.getenv("MYSQL_PORT", 3306))
@@ -44,6 +55,9 @@ MYSQL_ROOT_PASSWORD = os.getenv("MYSQL_ROOT_PASSWORD")
 MYSQL_USER = os.getenv("MYSQL_USER", "privateindexer")
 MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "privateindexer")
 MYSQL_DB = os.getenv("MYSQL_DB", "privateindexer")
+MYSQL_POOL_MIN_SIZE = int(os.getenv("MYSQL_POOL_MIN_SIZE", 5))
+MYSQL_POOL_MAX_SIZE = int(os.getenv("MYSQL_POOL_MAX_SIZE", 30))
+MYSQL_POOL_RECYCLE = int(os.getenv("MYSQL_POOL_RECYCLE", 300))
 
 MYSQL_MAX_RETY = 5
 MYSQL_RETRY_BACKOFF = 0.2
@@ -77,6 +91,11 @@ def validate_environment():
         logger.channel("config").exception(f"Exception while creating torrent data directory: {e}")
         exit(1)
 
+    # ensure bcrypt cost is within the range supported by bcrypt
+    if not 4 <= ADMIN_BCRYPT_COST <= 31:
+        logger.channel("config").critical(f"Invalid admin bcrypt cost (must be 4-31): {ADMIN_BCRYPT_COST}")
+        exit(1)
+
     # ensure server URL set
     if not EXTERNAL_SERVER_URL:
         logger.channel("config").critical(f"No external server URL set")
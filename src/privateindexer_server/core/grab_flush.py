@@ -0,0 +1,65 @@
+import asyncio
+import datetime
+
+from privateindexer_server.core import mysql, redis
+from privateindexer_server.core.config import GRAB_FLUSH_INTERVAL
+from privateindexer_server.core import logger
+
+# Redis hashes holding grab counts which have not yet been written to MySQL
+PENDING_TORRENT_GRABS_KEY = "grabs:pending:torrents"
+PENDING_USER_GRABS_KEY = "grabs:pending:users"
+
+
+async def flush_pending_grabs(pending_key: str, table: str) -> int:
+    """
+    Moves pending grab counts from a Redis hash into the grabs column of a MySQL table with one bulk update
+    """
+    redis_connection = redis.get_connection()
+
+    # atomically take the pending counts and clear them
+    pipe = redis_connection.pipeline()
+    await pipe.hgetall(pending_key)
+    await pipe.delete(pending_key)
+    pending, _ = await pipe.execute()
+
+    if not pending:
+        return 0
+
+    pending = {int(row_id): int(count) for row_id, count in pending.items()}
+
+    # build one update which adds each row's count through a CASE expression
+    case_sql = " ".join(["WHEN %s THEN %s"] * len(pending))
+    in_sql = ",".join(["%s"] * len(pending))
+    params = [value for row_id, count in pending.items() for value in (row_id, count)] + list(pending.keys())
+
+    try:
+        await mysql.execute(f"UPDATE {table} SET grabs = grabs + CASE id {case_sql} ELSE 0 END WHERE id IN ({in_sql})", tuple(params))
+    except Exception:
+        # put the counts back so they are retried on the next flush
+        pipe = redis_connection.pipeline()
+        for row_id, count in pending.items():
+            await pipe.hincrby(pending_key, row_id, count)
+        await pipe.execute()
+        raise
+
+    return sum(pending.values())
+
+
+async def periodic_grab_flush_task():
+    """
+    Task to write grab counters buffered in Redis to the database
+    """
+    logger.channel("grab-flush").debug("Task loop started")
+    while True:
+        try:
+            logger.channel("grab-flush").debug("Running grab counter flush")
+            before = datetime.datetime.now()
+
+            torrent_grabs = await flush_pending_grabs(PENDING_TORRENT_GRABS_KEY, "torrents")
+            await flush_pending_grabs(PENDING_USER_GRABS_KEY, "users")
+
+            delta = datetime.datetime.now() - before
+            logger.channel("grab-flush").debug(f"Grab counter flush complete ({delta}): {torrent_grabs} grabs written")
+        except Exception as e:
+            logger.channel("grab-flush").error(f"Error during periodic grab counter flush: {e}")
+        await asyncio.sleep(GRAB_FLUSH_INTERVAL)
@@ -5,7 +5,8 @@ from typing import Optional
 import aiomysql
 
 from privateindexer_server.core import logger
-from privateindexer_server.core.config import MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DB, MYSQL_MAX_RETY, MYSQL_RETRY_BACKOFF, MYSQL_ROOT_PASSWORD
+from privateindexer_server.core.config import MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DB, MYSQL_MAX_RETY, MYSQL_RETRY_BACKOFF, MYSQL_ROOT_PASSWORD, \
+    MYSQL_POOL_MIN_SIZE, MYSQL_POOL_MAX_SIZE, MYSQL_POOL_RECYCLE
 
 _db_pool: Optional[aiomysql.Pool] = None
 
@@ -62,6 +63,9 @@ TORRENTS_TABLE_SQL = """
                          UNIQUE KEY `hash_v1` (`hash_v1`),
                          UNIQUE KEY `hash_v2` (`hash_v2`),
                          KEY `torrents_users_id_fk` (`added_by_user_id`),
+                         KEY `added_on` (`added_on`),
+                         KEY `category_added_on` (`category`, `added_on`),
+                         FULLTEXT KEY `ft_normalized_name` (`normalized_name`) WITH PARSER ngram,
                          CONSTRAINT `torrents_users_id_fk` FOREIGN KEY (`added_by_user_id`) REFERENCES `users` (`id`) ON DELETE SET NULL
                      ) ENGINE = InnoDB
                        AUTO_INCREMENT = 5392
@@ -69,6 +73,13 @@ TORRENTS_TABLE_SQL = """
                        COLLATE = utf8mb4_general_ci
                      """
 
+# indexes added after the initial table definitions, used for the torznab "newest first" listings and name searches
+INDEX_MIGRATIONS = [
+    ("torrents", "added_on", "KEY `added_on` (`added_on`)"),
+    ("torrents", "category_added_on", "KEY `category_added_on` (`category`, `added_on`)"),
+    ("torrents", "ft_normalized_name", "FULLTEXT KEY `ft_normalized_name` (`normalized_name`) WITH PARSER ngram"),
+]
+
 
 async def setup_database():
     """
@@ -99,12 +110,17 @@ async def setup_database():
             logger.channel("mysql").debug(f"Granted privileges on '{MYSQL_DB}' to '{MYSQL_USER}'")
 
     # create the user connection pool
-    _db_pool = await aiomysql.create_pool(host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER, password=MYSQL_PASSWORD, db=MYSQL_DB, autocommit=True)
+    # keep warm connections around and recycle them before the server times them out
+    _db_pool = await aiomysql.create_pool(host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER, password=MYSQL_PASSWORD, db=MYSQL_DB, autocommit=True,
+                                          minsize=MYSQL_POOL_MIN_SIZE, maxsize=MYSQL_POOL_MAX_SIZE, pool_recycle=MYSQL_POOL_RECYCLE)
     logger.channel("mysql").debug(f"Connected to database '{MYSQL_DB}' as '{MYSQL_USER}'")
 
     # create any missing tables
     async with _db_pool.acquire() as conn:
         async with conn.cursor() as cur:
+            # normalized names have no word boundaries, so the ngram full-text index must not drop ngrams containing stopwords like "a"
+            await cur.execute("SET SESSION innodb_ft_enable_stopword = OFF")
+
             for table_name, create_sql in tables.items():
                 await cur.execute("SHOW TABLES LIKE %s", (table_name,))
                 exists = await cur.fetchone()
@@ -113,6 +129,15 @@ async def setup_database():
                     await cur.execute(create_sql)
                     logger.channel("mysql").info(f"Created table '{table_name}'")
 
+            # add any indexes missing from tables created by older versions
+            for table_name, index_name, index_sql in INDEX_MIGRATIONS:
+                await cur.execute(f"SHOW INDEX FROM `{table_name}` WHERE Key_name = %s", (index_name,))
+                exists = await cur.fetchone()
+
+                if not exists:
+                    await cur.execute(f"ALTER TABLE `{table_name}` ADD {index_sql}")
+                    logger.channel("mysql").info(f"Added index '{index_name}' to table '{table_name}'")
+
     logger.channel("mysql").debug("Database setup completed")
 
 
@@ -194,3 +219,28 @@ async def execute(query: str, params: tuple = (), include_row_id: bool = False,
                 return result
 
     return await _with_retry(_do)
+
+
+async def execute_many(query: str, params: list[tuple]):
+    """
+    Execute a query to MySQL once for each set of parameters over a single connection
+    """
+
+    async def _do():
+        async with _db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.executemany(query, params)
+
+    return await _with_retry(_do)
+
+
+async def run_with_connection(fn, *args):
+    """
+    Execute a callable with a dedicated pooled connection so session state such as temporary tables is shared between its queries
+    """
+
+    async def _do():
+        async with _db_pool.acquire() as conn:
+            return await fn(conn, *args)
+
+    return await _with_retry(_do)
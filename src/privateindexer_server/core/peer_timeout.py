@@ -3,7 +3,7 @@ import datetime
 import time
 
 from privateindexer_server.core import redis
-from privateindexer_server.core.config import PEER_TIMEOUT_INTERVAL, PEER_TIMEOUT
+from privateindexer_server.core.config import PEER_TIMEOUT_INTERVAL, PEER_TIMEOUT, REDIS_SCAN_COUNT
 from privateindexer_server.core import logger
 
 
@@ -22,19 +22,11 @@ async def periodic_peer_timeout_task():
             cutoff = int(time.time()) - PEER_TIMEOUT
             total_purged = 0
 
-            # use a cursor loop to scan all peers to prevent Redis database locking
-            cursor = 0
-            while True:
-                # match all peer keys
-                cursor, peer_keys = await redis_connection.scan(cursor=cursor, match="peers:*", count=10000, )
-
+            # use a cursor to scan all peers to prevent Redis database locking
+            async for peers_key in redis_connection.scan_iter(match="peers:*", count=REDIS_SCAN_COUNT):
                 # remove peers which have been living longer than PEER_TIMEOUT seconds
-                for peers_key in peer_keys:
-                    purged = await redis_connection.zremrangebyscore(peers_key, 0, cutoff, )
-                    total_purged += purged
-
-                if cursor == 0:
-                    break
+                purged = await redis_connection.zremrangebyscore(peers_key, 0, cutoff, )
+                total_purged += purged
 
             delta = datetime.datetime.now() - before
             logger.channel("peer-timeout").debug(f"Completed in {delta}, purged {total_purged} peers")
@@ -1,15 +1,45 @@
-import hashlib
 import secrets
-import time
+from typing import Any
 
+import orjson
 from fastapi import Query, Form, Header, HTTPException
 from fastapi.requests import Request
+from fastapi.responses import JSONResponse
+from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
 
 from privateindexer_server.core import logger
 from privateindexer_server.core import user_helper
+from privateindexer_server.core.config import SITE_NAME
 from privateindexer_server.core.user_helper import User
 
 
+def create_templates() -> Jinja2Templates:
+    """
+    Create the Jinja templates with a bytecode cache and compile every template ahead of the first request
+    """
+    env = Environment(loader=FileSystemLoader("/app/src/templates"), autoescape=True, auto_reload=False, bytecode_cache=FileSystemBytecodeCache())
+    env.globals["SITE_NAME"] = SITE_NAME
+
+    # pre-warm the template cache
+    for template_name in env.list_templates():
+        env.get_template(template_name)
+
+    return Jinja2Templates(env=env)
+
+
+templates = create_templates()
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response serialized with orjson instead of the standard library
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
+
+
 async def api_key_required(api_key_query: str | None = Query(None, alias="apikey"), api_key_form: str | None = Form(None, alias="apikey"),
                            api_key_header: str | None = Header(None, alias="X-API-Key"), ) -> User:
     """
@@ -38,13 +68,24 @@ def latency_threshold(ms: int):
     return set_latency_threshold
 
 
-def generate_sid() -> str:
+def generate_sid() -> tuple[str, int]:
+    """
+    Generate a random 128-bit session ID as both the cookie value and its integer session key
+    """
+    sid = secrets.token_hex(16)
+    return sid, int(sid, 16)
+
+
+def parse_sid(sid: str | None) -> int | None:
     """
-    Generate a simple session ID
+    Convert a session ID cookie value back into its integer session key
     """
-    nonce = secrets.token_hex(16)
-    raw = f"{nonce}:{time.time()}"
-    return hashlib.sha256(raw.encode()).hexdigest()
+    if not sid or len(sid) != 32:
+        return None
+    try:
+        return int(sid, 16)
+    except ValueError:
+        return None
 
 
 def get_client_ip(request: Request) -> str:
@@ -1,63 +1,108 @@
+import asyncio
 import datetime
+import os
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from fastapi import Request, APIRouter, Form, HTTPException, Depends
 from fastapi.params import Path
-from fastapi.responses import HTMLResponse, RedirectResponse, PlainTextResponse, JSONResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import HTMLResponse, RedirectResponse, PlainTextResponse
 
 from privateindexer_server.core import admin_helper, user_helper, utils
 from privateindexer_server.core import logger
 from privateindexer_server.core import route_helper
-from privateindexer_server.core.config import SITE_NAME
-from privateindexer_server.core.route_helper import latency_threshold
+from privateindexer_server.core.route_helper import latency_threshold, templates, ORJSONResponse
 
 router = APIRouter(prefix="/admin")
-templates = Jinja2Templates(directory="/app/src/templates")
-templates.env.globals["SITE_NAME"] = SITE_NAME
 
-SESSIONS = {}
+# bounded thread pool to run bcrypt hashing off the event loop
+BCRYPT_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="bcrypt")
+
+# serializes initial setup so concurrent requests cannot both pass the password check while the hash is computed
+SETUP_LOCK = asyncio.Lock()
+
+# pre-render the context-free login and setup pages served to unauthenticated visitors
+LOGIN_HTML = templates.get_template("admin_login.html").render().encode()
+SETUP_HTML = templates.get_template("admin_setup.html").render().encode()
+
+# sessions ordered by expiration so the oldest can be swept from the front
+SESSIONS: OrderedDict[int, int] = OrderedDict()
 # 30-day session lifetime
 SESSION_TTL = 60 * 60 * 24 * 30
+SESSION_TTL_NS = SESSION_TTL * 1_000_000_000
+# number of session validations between sweeps of expired sessions
+SESSION_SWEEP_INTERVAL = 1024
+# maximum number of live sessions before the oldest are evicted
+MAX_SESSIONS = 10_000
+
+_session_hits = 0
+
+
+def sweep_sessions(now: int):
+    """
+    Helper to remove expired sessions from the front of the session list
+    """
+    while SESSIONS and next(iter(SESSIONS.values())) < now:
+        SESSIONS.popitem(last=False)
 
 
 def validate_session(request: Request) -> bool:
     """
     Helper to validate admin sessions
     """
-    # get the SID cookie
-    sid = request.cookies.get("SID")
+    global _session_hits
+
+    now = time.monotonic_ns()
+
+    # periodically purge expired sessions
+    _session_hits += 1
+    if _session_hits >= SESSION_SWEEP_INTERVAL:
+        _session_hits = 0
+        sweep_sessions(now)
+
+    # get the SID cookie as an integer for the session lookup
+    sid = route_helper.parse_sid(request.cookies.get("SID"))
 
     # check session ID validity
-    if not sid or sid not in SESSIONS:
+    if sid is None or sid not in SESSIONS:
         return False
 
     # check expiration of session
-    if time.time() > SESSIONS[sid]:
+    if now > SESSIONS[sid]:
         # remove expired sessions
         del SESSIONS[sid]
         return False
 
-    # refresh session lifetime
-    SESSIONS[sid] = time.time() + SESSION_TTL
+    # refresh session lifetime and move it to the back of the expiration order
+    SESSIONS[sid] = now + SESSION_TTL_NS
+    SESSIONS.move_to_end(sid)
 
     return True
 
 
+def require_session(request: Request):
+    """
+    FastAPI dependency to reject requests without a valid admin session
+    """
+    if not validate_session(request):
+        raise HTTPException(status_code=401, detail="Invalid session")
+
+
 @router.get("/", response_class=HTMLResponse)
 async def dashboard(request: Request):
     """
     Used to view the admin panel for authenticated users or direct to setup/login page
     """
     # if there is no password set, allow the user to create one
-    if admin_helper.get_admin_password() is None:
-        return templates.TemplateResponse(name="admin_setup.html", request=request)
+    if not admin_helper.is_password_set():
+        return HTMLResponse(content=SETUP_HTML)
 
     # check if session is valid
     if not validate_session(request):
-        return templates.TemplateResponse(name="admin_login.html", request=request)
+        return HTMLResponse(content=LOGIN_HTML)
 
-    logger.channel("admin").info(f"Admin panel viewed")
+    logger.channel("admin").info("Admin panel viewed")
 
     return templates.TemplateResponse(name="admin_dashboard.html", request=request)
 
@@ -68,15 +113,16 @@ async def setup(request: Request, password: str = Form(...)):
     Used to initially set up the admin password
     Admin password can only be set if none is stored
     """
-    # make sure no password is set yet
-    if admin_helper.get_admin_password() is not None:
-        return RedirectResponse("/admin", status_code=302)
+    async with SETUP_LOCK:
+        # make sure no password is set yet
+        if admin_helper.is_password_set():
+            return RedirectResponse("/admin", status_code=302)
 
-    # make sure the password meets requirements
-    if not admin_helper.set_admin_password(password):
-        return templates.TemplateResponse(name="admin_setup.html", context={"error": "Password doesn't meet requirements"}, request=request)
+        # make sure the password meets requirements
+        if not await asyncio.get_running_loop().run_in_executor(BCRYPT_EXECUTOR, admin_helper.set_admin_password, password):
+            return templates.TemplateResponse(name="admin_setup.html", context={"error": "Password doesn't meet requirements"}, request=request)
 
-    logger.channel("admin").info(f"Admin password set")
+    logger.channel("admin").info("Admin password set")
 
     return RedirectResponse("/admin", status_code=302)
 
@@ -87,29 +133,32 @@ async def login(request: Request, password: str = Form(...)):
     Allows for user auth and session creation if password matches
     """
     # if password is incorrect, display error
-    if not admin_helper.verify_admin_password(password):
+    if not await asyncio.get_running_loop().run_in_executor(BCRYPT_EXECUTOR, admin_helper.verify_admin_password, password):
         return templates.TemplateResponse(name="admin_login.html", context={"error": "Invalid password"}, request=request)
 
-    sid = route_helper.generate_sid()
-    SESSIONS[sid] = time.time() + SESSION_TTL
+    now = time.monotonic_ns()
+
+    # purge expired sessions and evict the oldest sessions to bound memory under repeated logins
+    sweep_sessions(now)
+    while len(SESSIONS) >= MAX_SESSIONS:
+        SESSIONS.popitem(last=False)
+
+    sid, session_key = route_helper.generate_sid()
+    SESSIONS[session_key] = now + SESSION_TTL_NS
 
     response = RedirectResponse("/admin", status_code=302)
     response.set_cookie(key="SID", value=sid, httponly=True, secure=False, samesite="strict", path="/admin")
 
-    logger.channel("admin").info(f"Admin panel login succeeded")
+    logger.channel("admin").info("Admin panel login succeeded")
 
     return response
 
 
-@router.get("/users", response_class=HTMLResponse)
-async def get_users(request: Request):
+@router.get("/users", response_class=HTMLResponse, dependencies=[Depends(require_session)])
+async def get_users():
     """
     Retrieves a list of all users
     """
-    # check if session is valid
-    if not validate_session(request):
-        raise HTTPException(status_code=401, detail="Invalid session")
-
     users = await user_helper.get_users()
 
     # loop through each user and convert the datetime to a basic string
@@ -119,52 +168,40 @@ async def get_users(request: Request):
             user["last_seen_ago"] = utils.time_ago(user["last_seen"])
             user["last_seen"] = user["last_seen"].replace(tzinfo=tzinfo).strftime("%Y-%m-%d %I:%M:%S %p %Z")
 
-    return JSONResponse(users)
+    return ORJSONResponse(users)
 
 
-@router.post("/user", response_class=HTMLResponse, dependencies=[Depends(latency_threshold(1000))])
-async def create_user(request: Request, user_label: str = Form(...)):
+@router.post("/user", response_class=HTMLResponse, dependencies=[Depends(require_session), Depends(latency_threshold(1000))])
+async def create_user(user_label: str = Form(...)):
     """
     Creates a new user with the specified label
     """
-    # check if session is valid
-    if not validate_session(request):
-        raise HTTPException(status_code=401, detail="Invalid session")
-
     await user_helper.create_user(user_label)
 
-    logger.channel("admin").info(f"New user created: {user_label}")
+    logger.channel("admin").info("New user created: %s", user_label)
 
     return PlainTextResponse("User created")
 
 
-@router.post("/user/{user_id}", response_class=HTMLResponse, dependencies=[Depends(latency_threshold(1000))])
-async def update_user(request: Request, user_id: int = Path(...), user_label: str = Form(None), rotate_key: bool = Form(False)):
+@router.post("/user/{user_id}", response_class=HTMLResponse, dependencies=[Depends(require_session), Depends(latency_threshold(1000))])
+async def update_user(user_id: int = Path(...), user_label: str = Form(None), rotate_key: bool = Form(False)):
     """
     Rotates a user's API key
     """
-    # check if session is valid
-    if not validate_session(request):
-        raise HTTPException(status_code=401, detail="Invalid session")
-
     await user_helper.update_user(user_id, user_label, rotate_key)
 
-    logger.channel("admin").info(f"User ID updated: {user_id}")
+    logger.channel("admin").info("User ID updated: %s", user_id)
 
     return PlainTextResponse("User key rotated")
 
 
-@router.delete("/user/{user_id}", response_class=HTMLResponse, dependencies=[Depends(latency_threshold(1000))])
-async def delete_user(request: Request, user_id: int = Path(...)):
+@router.delete("/user/{user_id}", response_class=HTMLResponse, dependencies=[Depends(require_session), Depends(latency_threshold(1000))])
+async def delete_user(user_id: int = Path(...)):
     """
     Deletes a user from database if exists
     """
-    # check if session is valid
-    if not validate_session(request):
-        raise HTTPException(status_code=401, detail="Invalid session")
-
     await user_helper.delete_user(user_id)
 
-    logger.channel("admin").info(f"User ID deleted: {user_id}")
+    logger.channel("admin").info("User ID deleted: %s", user_id)
 
     return PlainTextResponse("User deleted")
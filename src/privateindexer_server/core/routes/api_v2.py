@@ -1,23 +1,24 @@
+import asyncio
 import itertools
 import os
-import re
 import shutil
-import socket
 import tempfile
-from collections import defaultdict
+import weakref
 
 import libtorrent as lt
-from fastapi import HTTPException, Query, Request, UploadFile, File, Form, APIRouter, Depends
-from fastapi.responses import Response, PlainTextResponse, JSONResponse
+import msgspec
+import numpy as np
+from fastapi import BackgroundTasks, HTTPException, Query, Request, UploadFile, File, Form, APIRouter, Depends
+from fastapi.responses import PlainTextResponse, FileResponse
 
 from privateindexer_server.core import logger
-from privateindexer_server.core import mysql, utils, redis, route_helper
-from privateindexer_server.core.config import CATEGORIES, SYNC_BATCH_SIZE
+from privateindexer_server.core import mysql, utils, redis, route_helper, grab_flush
+from privateindexer_server.core.config import CATEGORY_IDS, DATA_DIR, SYNC_BATCH_SIZE, SYNC_CONCURRENCY
 from privateindexer_server.core.jwt_helper import AccessTokenValidator
-from privateindexer_server.core.route_helper import api_key_required, latency_threshold
+from privateindexer_server.core.route_helper import api_key_required, latency_threshold, ORJSONResponse
 from privateindexer_server.core.user_helper import User
 
-router = APIRouter(prefix="/api/v2")
+router = APIRouter(prefix="/api/v2", default_response_class=ORJSONResponse)
 
 
 @router.get("/health")
@@ -37,84 +38,66 @@ async def get_analytics(user: User = Depends(api_key_required)):
     try:
         redis_connection = redis.get_connection()
 
-        # fetch basic stats from Redis
-        requests = int((await redis_connection.get("stats:requests")) or 0)
-        bytes_sent = int((await redis_connection.get("stats:bytes_sent")) or 0)
-        bytes_received = int((await redis_connection.get("stats:bytes_received")) or 0)
-        unique_visitors = await redis_connection.scard("stats:unique_ips")
+        # fetch basic stats and the request times list from Redis in one round-trip, without MULTI/EXEC since these are only reads
+        pipe = redis_connection.pipeline(transaction=False)
+        await pipe.mget("stats:requests", "stats:bytes_sent", "stats:bytes_received")
+        await pipe.scard("stats:unique_ips")
+        await pipe.lrange("stats:request_times", -utils.REQUEST_TIMES_WINDOW, -1)
+        (requests, bytes_sent, bytes_received), unique_visitors, times_raw = await pipe.execute()
 
-        # process the request times list and normalize negative values
-        times_raw = await redis_connection.lrange("stats:request_times", -1000, -1)
-        times = [float(t) for t in times_raw] if times_raw else []
+        requests = int(requests or 0)
+        bytes_sent = int(bytes_sent or 0)
+        bytes_received = int(bytes_received or 0)
 
         # convert the request times into three values - min, max, and average
-        request_time_avg = (sum(times) / len(times)) / 1000 if times else 0.0
-        request_time_min = min(times) / 1000 if times else 0.0
-        request_time_max = max(times) / 1000 if times else 0.0
-
-        # obtain all peer keys from Redis with a looping cursor to prevent locking the Redis server with huge numbers of peers
-        peer_keys = []
-        cursor = 0
-        while True:
-            cursor, keys = await redis_connection.scan(cursor=cursor, match="peer:*:*", count=1000)
-            peer_keys.extend(keys)
-            if cursor == 0:
-                break
-
-        # fetch all peer hashes in one go using a pipeline
-        pipe = redis_connection.pipeline()
-        for peer_key in peer_keys:
-            await pipe.hgetall(peer_key)
-        all_peers_data = await pipe.execute()
-
-        # aggregate each peer with its mapped data to each torrent which it belongs to
-        torrents = defaultdict(lambda: {"seeders": 0, "leechers": 0})
-        for peer_key, peer_data in zip(peer_keys, all_peers_data):
-            # skip invalid peer data
-            if not peer_data:
-                continue
-
-            # parse torrent_id from key "peer:{torrent_id}:{peer_id}"
-            _, torrent_id, _ = peer_key.split(":")
-            torrent_id = int(torrent_id)
-
-            # increment seeders/leechers based on peer's peice data left to obtain
-            left = int(peer_data.get("left", 1))
-            if left == 0:
-                torrents[torrent_id]["seeders"] += 1
-            else:
-                torrents[torrent_id]["leechers"] += 1
+        if times_raw:
+            times = np.fromiter(times_raw, dtype=np.float64, count=len(times_raw))
+            request_time_avg = float(times.mean()) / 1000
+            request_time_min = float(times.min()) / 1000
+            request_time_max = float(times.max()) / 1000
+        else:
+            request_time_avg = request_time_min = request_time_max = 0.0
 
-        # add all the aggregated data up to gather totals
-        total_peers = sum(v["seeders"] + v["leechers"] for v in torrents.values())
-        seeding_torrents = sum(1 for v in torrents.values() if v["seeders"])
-        leeching_torrents = sum(1 for v in torrents.values() if v["leechers"])
+        # aggregate peer data a page at a time so the scan never blocks Redis
+        total_peers, seeding_torrents, leeching_torrents = await utils.get_peer_totals()
 
     except Exception as e:
         logger.channel("analytics").exception(f"Failed to get analytics from Redis: {e}")
-        return JSONResponse({})
-
-    # fetch all user data transfer statistics
-    data_transfer = await mysql.fetch_one("SELECT SUM(downloaded) AS total_downloaded, SUM(uploaded) AS total_uploaded FROM users")
-    total_downloaded = int(data_transfer["total_downloaded"] or 0)
-    total_uploaded = int(data_transfer["total_uploaded"] or 0)
+        return ORJSONResponse({})
 
-    # gather various stats from the torrents table
-    torrent_metrics = await mysql.fetch_one("SELECT COUNT(*) as total_torrents, SUM(grabs) as grabs FROM torrents")
-    total_torrents = int(torrent_metrics.get("total_torrents", 0))
-    grabs_total = int(torrent_metrics.get("grabs") or 0)
+    # fetch all user data transfer statistics and various stats from the torrents table in a single round-trip
+    metrics = await mysql.fetch_one("SELECT u.total_downloaded, u.total_uploaded, t.total_torrents, t.grabs "
+                                    "FROM (SELECT SUM(downloaded) AS total_downloaded, SUM(uploaded) AS total_uploaded FROM users) u, "
+                                    "(SELECT COUNT(*) AS total_torrents, SUM(grabs) AS grabs FROM torrents) t")
+    total_downloaded = int(metrics["total_downloaded"] or 0)
+    total_uploaded = int(metrics["total_uploaded"] or 0)
+    total_torrents = int(metrics["total_torrents"] or 0)
+    grabs_total = int(metrics["grabs"] or 0)
 
     analytics = {"requests": int(requests), "bytes_sent": int(bytes_sent), "bytes_received": int(bytes_received), "unique_visitors": unique_visitors,
                  "total_torrents": total_torrents, "seeding_torrents": seeding_torrents, "leeching_torrents": leeching_torrents, "total_peers": total_peers,
                  "total_grabs": grabs_total, "total_downloaded": total_downloaded, "total_uploaded": total_uploaded, "request_time_avg": request_time_avg,
                  "request_time_min": request_time_min, "request_time_max": request_time_max, }
 
-    return JSONResponse(analytics)
+    return ORJSONResponse(analytics)
+
+
+async def _probe_client(user: User, announce_ip: str, port: int, v: str):
+    """
+    Check whether a client is reachable at the IP and port they sent us and store the result
+    """
+    reachable = await utils.check_reachable(announce_ip, port)
+    if reachable:
+        logger.channel("user").info(f"User '{user.user_label}' ({announce_ip}:{port}) connected with PrivateIndexer client v{v}")
+    else:
+        logger.channel("user").warning(f"User '{user.user_label}' ({announce_ip}:{port} - UNREACHABLE) connected with PrivateIndexer client v{v}")
+
+    await mysql.execute("UPDATE users SET reachable = %s WHERE id = %s", (reachable, user.user_id))
 
 
 @router.get("/user")
-async def user_login_check(user: User = Depends(api_key_required), request: Request = None, v: str = Query(...), announce_ip: str = Query(None), port: int = Query(None),
-                           public_uploads: bool = Query(...)):
+async def user_login_check(background_tasks: BackgroundTasks, user: User = Depends(api_key_required), request: Request = None, v: str = Query(...),
+                           announce_ip: str = Query(None), port: int = Query(None), public_uploads: bool = Query(...)):
     """
     Called by PrivateIndexer clients during startup to validate the API key and update the server with preferences/stats
     """
@@ -122,22 +105,20 @@ async def user_login_check(user: User = Depends(api_key_required), request: Requ
     announce_ip = announce_ip or route_helper.get_client_ip(request)
     port = port or 6881
 
-    # check to see if the client is reachable at the IP and port they sent us
-    reachable = False
-    try:
-        with socket.create_connection((announce_ip, port), timeout=5):
-            reachable = True
-            logger.channel("user").info(f"User '{user.user_label}' ({announce_ip}:{port}) connected with PrivateIndexer client v{v}")
-    except (socket.timeout, ConnectionRefusedError, OSError):
-        logger.channel("user").warning(f"User '{user.user_label}' ({announce_ip}:{port} - UNREACHABLE) connected with PrivateIndexer client v{v}")
-        pass
+    # update the user's entry with the data and read back the last known reachability
+    _, last_status = await asyncio.gather(
+        mysql.execute("UPDATE users SET client_version = %s, last_ip = %s, last_seen=NOW(), public_uploads = %s WHERE id = %s",
+                      (v, f"{announce_ip}:{port}", public_uploads, user.user_id)),
+        mysql.fetch_one("SELECT reachable FROM users WHERE id = %s", (user.user_id,)))
+
+    # check to see if the client is reachable at the IP and port they sent us after replying, so startup never waits on the probe
+    background_tasks.add_task(_probe_client, user, announce_ip, port, v)
 
-    # update the user's entry with the data
-    await mysql.execute("UPDATE users SET client_version = %s, last_ip = %s, last_seen=NOW(), reachable = %s, public_uploads = %s WHERE id = %s",
-                        (v, f"{announce_ip}:{port}", reachable, public_uploads, user.user_id))
+    # the probe result is not known yet, so report the last known state (null if the client has never been checked)
+    reachable = None if not last_status or last_status["reachable"] == -1 else bool(last_status["reachable"])
 
     user_data = {"user_label": user.user_label, "announce_ip": announce_ip, "is_reachable": reachable, }
-    return JSONResponse(user_data)
+    return ORJSONResponse(user_data)
 
 
 @router.get("/user/stats")
@@ -169,7 +150,7 @@ async def get_user_stats(user: User = Depends(api_key_required)):
     else:
         server_ratio = 0.0
 
-    return JSONResponse(
+    return ORJSONResponse(
         {"user": user.user_label, "torrents_added_total": torrents_uploaded, "currently_seeding": seeding, "currently_leeching": leeching, "grabs_total": grabs,
          "popularity": popularity, "total_download": downloaded, "total_upload": uploaded, "server_ratio": server_ratio, })
 
@@ -187,32 +168,26 @@ async def grab(user: User = Depends(AccessTokenValidator("grab")), infohash: str
 
     hash_v2 = torrent["hash_v2"]
 
-    # ensure the torrent file exists on disk
+    # ensure the torrent file exists on disk, keeping the stat result so the response does not stat the file again
     torrent_file = utils.get_torrent_file(hash_v2)
-    if not os.path.exists(torrent_file):
+    try:
+        torrent_stat = os.stat(torrent_file)
+    except FileNotFoundError:
         logger.channel("grab").critical(f"Torrent file missing for hash {infohash}")
         raise HTTPException(status_code=404, detail="Torrent file missing")
 
     torrent_filename = os.path.basename(torrent_file)
 
-    # attempt to read the file
-    try:
-        with open(torrent_file, "rb") as f:
-            bencoded = f.read()
-    except Exception as e:
-        logger.channel("grab").exception(f"Failed to read torrent with hash '{infohash}: {e}")
-        raise HTTPException(status_code=500, detail="Internal server error")
-
-    # increment the torrent grab counter
-    await mysql.execute("UPDATE torrents SET grabs = grabs + 1 WHERE id=%s", (torrent["id"],))
-
-    # increment the user grab counter
-    await mysql.execute("UPDATE users SET grabs = grabs + 1 WHERE id=%s", (user.user_id,))
+    # increment the torrent and user grab counters in Redis to be flushed to the database periodically
+    pipe = redis.get_connection().pipeline()
+    await pipe.hincrby(grab_flush.PENDING_TORRENT_GRABS_KEY, torrent["id"], 1)
+    await pipe.hincrby(grab_flush.PENDING_USER_GRABS_KEY, user.user_id, 1)
+    await pipe.execute()
 
     logger.channel("grab").info(f"User '{user.user_label}' grabbed torrent by hash '{infohash}'")
 
-    # reply with the bencoded response over x-bittorrent protocol
-    return Response(content=bencoded, media_type="application/x-bittorrent", headers={"Content-Disposition": f'attachment; filename="{torrent_filename}"'})
+    # stream the stored bencoded file over x-bittorrent protocol without loading it into memory
+    return FileResponse(torrent_file, media_type="application/x-bittorrent", filename=torrent_filename, stat_result=torrent_stat)
 
 
 @router.get("/validate")
@@ -232,6 +207,22 @@ async def validate(user: User = Depends(api_key_required), infohash: str = Query
     return PlainTextResponse("Torrent is valid")
 
 
+def _copy_upload_to_temporary_file(upload) -> str:
+    """
+    Copy an uploaded file object into a new temporary file in 1 MiB chunks and return its path
+    """
+    # stage inside the data directory so the final move into the torrents directory is a plain rename rather than a copy,
+    # but outside the torrents directory itself so the database check never purges an upload in progress
+    with tempfile.NamedTemporaryFile(dir=DATA_DIR, prefix=".upload-", suffix=".torrent", delete=False) as temporary_download_file:
+        try:
+            shutil.copyfileobj(upload, temporary_download_file, length=1 << 20)
+        except Exception:
+            # don't leave a partial upload behind in the data directory
+            os.unlink(temporary_download_file.name)
+            raise
+        return temporary_download_file.name
+
+
 @router.post("/upload")
 async def upload(user: User = Depends(api_key_required), category: int = Form(...), torrent_file: UploadFile = File(...), torrent_name: str = Form(...),
                  imdbid: str = Form(None), tmdbid: int = Form(None), tvdbid: int = Form(None), artist: str = Form(None), album: str = Form(None)):
@@ -242,8 +233,7 @@ async def upload(user: User = Depends(api_key_required), category: int = Form(..
     user_label = user.user_label
 
     # ensure the client is using a valid torznab category
-    category_id_list = [cat["id"] for cat in CATEGORIES]
-    if category not in category_id_list:
+    if category not in CATEGORY_IDS:
         logger.channel("upload").warning(f"User '{user_label}' tried to upload with invalid category ({category}): {torrent_file.filename}")
         raise HTTPException(status_code=400, detail="Invalid category")
 
@@ -252,94 +242,231 @@ async def upload(user: User = Depends(api_key_required), category: int = Form(..
         logger.channel("upload").warning(f"User '{user_label}' tried to upload non-torrent file: {torrent_file.filename}")
         raise HTTPException(status_code=400, detail="File must be torrent file")
 
-    # save the data to a temporary file
-    temporary_download_file = tempfile.NamedTemporaryFile()
-    temporary_download_file.write(await torrent_file.read())
-    torrent_download_path = temporary_download_file.name
+    # copy the spooled upload straight into a temporary file without buffering it in memory or blocking the event loop
+    torrent_download_path = await asyncio.to_thread(_copy_upload_to_temporary_file, torrent_file.file)
 
+    # the temporary file is removed on every exit path unless it was moved into storage or handed to a background task
+    temporary_file_pending = True
     try:
-        # get the infodata from the torrent file
-        info = lt.torrent_info(torrent_download_path)
-
-        # try remove any trackers
-        if len(list(info.trackers())) > 0:
-            try:
-                info.clear_trackers()
-                logger.channel("upload").debug("Trackers removed from file")
-            except Exception:
-                logger.channel("upload").debug("No trackers required removal")
-                pass
-
-        # strip all invalid characters from the torrent name
-        normalized_torrent_name = utils.clean_text_filter(torrent_name)
-
-        file_count = len(info.files())
-        size = info.total_size()
-        hash_v1, hash_v2 = utils.get_torrent_hashes(torrent_download_path)
-
-        # truncate the v2 hash for quick torrent announcement matching
-        hash_v2_truncated = hash_v2[:40]
-
-        # check to see if we can pull a season/episode number from the torrent name
-        season_match, episode_match = utils.extract_season_episode(torrent_name)
-    except Exception as e:
-        # remove invalid temporary torrent file
-        if os.path.exists(torrent_download_path):
+        try:
+            # get the infodata from the torrent file
+            info = lt.torrent_info(torrent_download_path)
+
+            # try remove any trackers
+            if len(list(info.trackers())) > 0:
+                try:
+                    info.clear_trackers()
+                    logger.channel("upload").debug("Trackers removed from file")
+                except Exception:
+                    logger.channel("upload").debug("No trackers required removal")
+                    pass
+
+            # strip all invalid characters from the torrent name
+            normalized_torrent_name = utils.clean_text_filter(torrent_name)
+
+            file_count = len(info.files())
+            size = info.total_size()
+            # reuse the parsed info rather than reading and decoding the file a second time
+            hash_v1, hash_v2 = utils.get_torrent_hashes(info)
+
+            # truncate the v2 hash for quick torrent announcement matching
+            hash_v2_truncated = hash_v2[:40]
+
+            # check to see if we can pull a season/episode number from the torrent name
+            season_match, episode_match = utils.extract_season_episode(torrent_name)
+        except Exception as e:
+            logger.channel("upload").warning(f"Failed to process torrent file sent by '{user_label}', file was rejected: '{torrent_file.filename}': {e}")
+            raise HTTPException(status_code=422, detail="Invalid torrent file")
+
+        # add optional indexing parameters
+        if imdbid:
+            imdbid_digits = utils.NON_DIGIT_REGEX.sub("", imdbid)
+            if not imdbid_digits:
+                logger.channel("upload").warning(f"User '{user_label}' tried to upload with invalid IMDb ID ({imdbid}): {torrent_file.filename}")
+                raise HTTPException(status_code=422, detail="Invalid IMDb ID")
+            imdbid = int(imdbid_digits)
+
+        if artist:
+            artist = utils.clean_text_filter(artist)
+
+        if album:
+            album = utils.clean_text_filter(album)
+
+        # check to see if this torrent already exists in the database
+        # each branch of the union uses its own unique hash index instead of an OR across both columns
+        existing = await mysql.fetch_one("(SELECT id, name, added_by_user_id FROM torrents WHERE hash_v1=%s LIMIT 1) UNION ALL "
+                                         "(SELECT id, name, added_by_user_id FROM torrents WHERE hash_v2=%s LIMIT 1) LIMIT 1", (hash_v1, hash_v2))
+        if existing:
+            # the client only needs the 409 verdict, so defer the database and filesystem work until after the response is sent
+            background = BackgroundTasks()
+
+            # if the torrent exists and this user was the original uploader, overwrite the old metadata with the new
+            if existing["added_by_user_id"] == user_id:
+                background.add_task(mysql.execute,
+                                    "UPDATE torrents SET name = %s, normalized_name = %s, hash_v1 = %s, hash_v2 = %s, hash_v2_trunc = %s, season = %s, episode = %s, imdbid = %s, tmdbid = %s, tvdbid = %s, artist = %s, album = %s, last_seen = NOW() WHERE id = %s",
+                                    (torrent_name, normalized_torrent_name, hash_v1, hash_v2, hash_v2_truncated, season_match, episode_match, imdbid, tmdbid, tvdbid,
+                                     artist, album, existing["id"]))
+                background.add_task(utils.invalidate_rss_cache)
+                logger.channel("upload").info(f"User '{user_label}' re-uploaded torrent, renamed to '{torrent_name}'")
+
+            # ignore the upload if this user was no the original uploader
+            else:
+                logger.channel("upload").debug(f"User '{user_label}' uploaded duplicate torrent: '{torrent_name}'")
+
+            # delete the temporary file, handing it over to the background task
+            background.add_task(os.unlink, torrent_download_path)
+            temporary_file_pending = False
+            return ORJSONResponse({"detail": "Torrent with same hash exists, updated name in database"}, status_code=409, background=background)
+
+        # move the temporary file to the permanent torrent storage directory before the row exists, so the torrent is never listed without a file,
+        # renaming relative to the already open directory instead of walking its path
+        await utils.move_file(torrent_download_path, utils.get_torrent_filename(hash_v2), destination_dir_fd=utils.get_torrents_dir_fd())
+        temporary_file_pending = False
+
+        # add the final metadata to the database
+        await mysql.execute("""
+                            INSERT INTO torrents (name, normalized_name, season, episode, imdbid, tmdbid, tvdbid, artist, album, size, category, hash_v1,
+                                                  hash_v2, hash_v2_trunc, files, added_on, added_by_user_id, last_seen)
+                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), %s, NOW())
+                            """,
+                            (torrent_name, normalized_torrent_name, season_match, episode_match, imdbid, tmdbid, tvdbid, artist, album, size, category,
+                             hash_v1, hash_v2, hash_v2_truncated, file_count, user_id))
+
+        # drop cached RSS feeds so the new torrent shows up on the next poll
+        await utils.invalidate_rss_cache()
+
+        logger.channel("upload").info(f"User '{user_label}' uploaded torrent '{torrent_name}'")
+
+        return PlainTextResponse("Successfully uploaded torrent")
+    finally:
+        if temporary_file_pending and os.path.exists(torrent_download_path):
             os.unlink(torrent_download_path)
 
-        logger.channel("upload").warning(f"Failed to process torrent file sent by '{user_label}', file was rejected: '{torrent_file.filename}': {e}")
-        raise HTTPException(status_code=422, detail="Invalid torrent file")
 
-    # add optional indexing parameters
-    if imdbid:
-        imdbid = int(re.sub(r"\D", "", imdbid))
+class SyncTorrent(msgspec.Struct):
+    """
+    Torrent entry sent by clients during a sync
+    """
+    id: int
+    infohash: str | None = None
+    name: str | None = None
 
-    if artist:
-        artist = utils.clean_text_filter(artist)
 
-    if album:
-        album = utils.clean_text_filter(album)
+# lax decoding coerces values like string ids the way the old dict-based parsing tolerated them, and unknown fields are ignored
+SYNC_DECODER = msgspec.json.Decoder(list[SyncTorrent], strict=False)
 
-    # check to see if this torrent already exists in the database
-    existing = await mysql.fetch_one("SELECT id, name, added_by_user_id FROM torrents WHERE hash_v1=%s OR hash_v2=%s", (hash_v1, hash_v2))
-    if existing:
+# syncs with at most this many valid torrents skip the temporary table
+SYNC_SMALL_THRESHOLD = 64
 
-        # if the torrent exists and this user was the original uploader, overwrite the old metadata with the new
-        if existing["added_by_user_id"] == user_id:
-            await mysql.execute(
-                "UPDATE torrents SET name = %s, normalized_name = %s, hash_v1 = %s, hash_v2 = %s, hash_v2_trunc = %s, season = %s, episode = %s, imdbid = %s, tmdbid = %s, tvdbid = %s, artist = %s, album = %s, last_seen = NOW() WHERE id = %s",
-                (torrent_name, normalized_torrent_name, hash_v1, hash_v2, hash_v2_truncated, season_match, episode_match, imdbid, tmdbid, tvdbid, artist, album,
-                 existing["id"]))
-            logger.channel("upload").info(f"User '{user_label}' re-uploaded torrent, renamed to '{torrent_name}'")
+# stays well below MySQL's default 64 MB max_allowed_packet
+SYNC_MAX_STATEMENT_LENGTH = 16 * 1024 * 1024
 
-        # ignore the upload if this user was no the original uploader
-        else:
-            logger.channel("upload").debug(f"User '{user_label}' uploaded duplicate torrent: '{torrent_name}'")
+# matches the width of the name columns in the torrents table, longer client names are truncated to fit
+SYNC_NAME_MAX_LENGTH = 255
 
-        # delete the temporary file
-        os.unlink(torrent_download_path)
-        raise HTTPException(status_code=409, detail="Torrent with same hash exists, updated name in database")
+# InnoDB keeps rows variable-width and spills to disk, unlike MEMORY which pads every varchar and is capped by max_heap_table_size
+SYNC_TABLE_SQL = """
+                 CREATE TEMPORARY TABLE IF NOT EXISTS `sync_client_torrents`
+                 (
+                     `id`              bigint                                  NOT NULL,
+                     `infohash`        char(64) CHARACTER SET ascii            NOT NULL,
+                     `name`            varchar(255) COLLATE utf8mb4_general_ci NULL,
+                     `normalized_name` varchar(255) COLLATE utf8mb4_general_ci NULL,
+                     KEY `infohash` (`infohash`)
+                 ) ENGINE = InnoDB
+                   DEFAULT CHARSET = utf8mb4
+                   COLLATE = utf8mb4_general_ci
+                 """
 
-    # move the temporary file to the permanent torrent storage directory
-    torrent_save_path = utils.get_torrent_file(hash_v2)
-    shutil.move(torrent_download_path, torrent_save_path)
+# pooled connections which already hold the sync temporary table in their session
+SYNC_TABLE_CONNECTIONS: weakref.WeakSet = weakref.WeakSet()
 
-    # remove dangling temporary torrent file
-    if os.path.exists(torrent_download_path):
-        os.unlink(torrent_download_path)
 
-    # add the final metadata to the database
-    await mysql.execute("""
-                        INSERT INTO torrents (name, normalized_name, season, episode, imdbid, tmdbid, tvdbid, artist, album, size, category, hash_v1,
-                                              hash_v2, hash_v2_trunc, files, added_on, added_by_user_id, last_seen)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), %s, NOW())
-                        """,
-                        (torrent_name, normalized_torrent_name, season_match, episode_match, imdbid, tmdbid, tvdbid, artist, album, size, category,
-                         hash_v1, hash_v2, hash_v2_truncated, file_count, user_id))
+async def _sync_batch(conn, batch: tuple[tuple[int, str, str | None, str | None], ...], user_id: int) -> list[int]:
+    """
+    Load a batch of client torrents into a temporary table once and run the missing lookup and name update against it
+    """
+    try:
+        # plain tuple rows are enough here and skip building a dict per row
+        async with conn.cursor() as cur:
+            # the temporary table lives for the pooled connection's session, so only create it the first time a connection syncs
+            # and clear out rows left by a previous sync
+            if conn not in SYNC_TABLE_CONNECTIONS:
+                await cur.execute(SYNC_TABLE_SQL)
+                SYNC_TABLE_CONNECTIONS.add(conn)
+            await cur.execute("TRUNCATE TABLE sync_client_torrents")
+
+            # let executemany send the whole batch as one multi-row insert instead of splitting it at the 1 MB default
+            cur.max_stmt_length = SYNC_MAX_STATEMENT_LENGTH
+            await cur.executemany("INSERT INTO sync_client_torrents (id, infohash, name, normalized_name) VALUES (%s, %s, %s, %s)", batch)
+
+            # find torrents which do not exist in the database yet, and flag the ones whose names the client has changed
+            await cur.execute("""
+                              SELECT
+                                  c.id,
+                                  t.hash_v2 IS NULL OR (t.hash_v1 IS NULL AND t.added_by_user_id = %s) AS missing,
+                                  c.name IS NOT NULL AND c.normalized_name IS NOT NULL AND t.added_by_user_id = %s
+                                      AND (t.name != c.name OR t.normalized_name != c.normalized_name) AS renamed
+                              FROM sync_client_torrents c
+                              LEFT JOIN torrents t
+                                ON t.hash_v2 = c.infohash
+                              HAVING missing OR renamed
+                              """, (user_id, user_id))
+            result = await cur.fetchall()
+            missing_ids = [torrent_id for torrent_id, missing, _ in result if missing]
+
+            # reset the name and normalized name in the database to match what the client sent us (only if they are original uploader)
+            # most syncs change nothing, so skip the update entirely unless the lookup found a renamed torrent
+            if any(renamed for _, _, renamed in result):
+                await cur.execute("""
+                                  UPDATE torrents t
+                                  JOIN sync_client_torrents c
+                                    ON c.infohash = t.hash_v2
+                                  SET t.name = c.name, t.normalized_name = c.normalized_name
+                                  WHERE
+                                      c.name IS NOT NULL AND c.normalized_name IS NOT NULL AND t.added_by_user_id = %s
+                                      AND (t.name != c.name OR t.normalized_name != c.normalized_name)
+                                  """, (user_id,))
+
+                # renamed torrents change both the cached feeds and which searches they match
+                await utils.invalidate_rss_cache()
+    except Exception:
+        # the session may have been reset underneath us, so make sure the table exists on the retry
+        SYNC_TABLE_CONNECTIONS.discard(conn)
+        raise
+
+    return missing_ids
+
+
+async def _sync_small(rows: list[tuple[int, str, str | None, str | None]], user_id: int) -> list[int]:
+    """
+    Resolve a small sync with one IN lookup and compare the results in Python
+    """
+    placeholders = ", ".join(["%s"] * len(rows))
+    result = await mysql.fetch_all(f"SELECT id, hash_v1, hash_v2, name, normalized_name, added_by_user_id FROM torrents WHERE hash_v2 IN ({placeholders})",
+                                   tuple(infohash for _, infohash, _, _ in rows))
+    existing = {torrent["hash_v2"].lower(): torrent for torrent in result}
+
+    missing_ids = []
+    renames = []
+    for torrent_id, infohash, torrent_name, normalized_torrent_name in rows:
+        torrent = existing.get(infohash.lower())
+        if torrent is None or (torrent["hash_v1"] is None and torrent["added_by_user_id"] == user_id):
+            missing_ids.append(torrent_id)
 
-    logger.channel("upload").info(f"User '{user_label}' uploaded torrent '{torrent_name}'")
+        # reset the name and normalized name in the database to match what the client sent us (only if they are original uploader)
+        # identical names can be skipped here, but any other difference is left to MySQL so it is judged by the same collation as the batch path
+        if torrent is not None and torrent_name is not None and normalized_torrent_name is not None and torrent["added_by_user_id"] == user_id and (
+                torrent["name"] != torrent_name or torrent["normalized_name"] != normalized_torrent_name):
+            renames.append((torrent_name, normalized_torrent_name, torrent["id"], torrent_name, normalized_torrent_name))
 
-    return PlainTextResponse("Successfully uploaded torrent")
+    if renames:
+        await mysql.execute_many("UPDATE torrents SET name = %s, normalized_name = %s WHERE id = %s AND (name != %s OR normalized_name != %s)", renames)
+
+        # renamed torrents change both the cached feeds and which searches they match
+        await utils.invalidate_rss_cache()
+
+    return missing_ids
 
 
 @router.post("/sync", dependencies=[Depends(latency_threshold(5000))])
@@ -347,71 +474,49 @@ async def sync(user: User = Depends(api_key_required), request: Request = None):
     """
     Called by clients with their list of tracked torrents including local ID, infohash, and torrent name to sync with the server database
     """
-    torrents: list[dict[str, int | str]] = await request.json()
+    # decode the body straight into typed structs instead of generic dicts
+    try:
+        torrents = SYNC_DECODER.decode(await request.body())
+    except msgspec.DecodeError:
+        raise HTTPException(status_code=422, detail="Invalid sync payload")
 
-    # loop through each torrent
-    rows = []
+    # only add valid infohashes to the search, anything which is not a v2 hex digest can never match and is reported missing straight away
+    valid_torrents = []
+    malformed_ids = []
     for t in torrents:
-        infohash = t.get("infohash")
-        torrent_name = t.get("name")
-        # remove invalid characters from the torrent name
-        normalized_torrent_name = utils.clean_text_filter(torrent_name) if torrent_name else None
-
-        # only add valid infohashes to the search
-        if infohash:
-            rows.append((t["id"], infohash, torrent_name, normalized_torrent_name))
+        if t.infohash:
+            if utils.INFOHASH_V2_REGEX.fullmatch(t.infohash):
+                valid_torrents.append(t)
+            else:
+                malformed_ids.append(t.id)
 
     # if none of the sent rows were valid, return a mirrored response
-    if not rows:
-        return JSONResponse({"missing_ids": [t["id"] for t in torrents]})
-
-    missing_ids: list[int] = []
-
-    # create batches of torrents to search for in the database to reduce large queries
-    for batch in itertools.batched(rows, SYNC_BATCH_SIZE):
-        selects = []
-        params = []
-
-        # loop through each torrent and add it to the union select query
-        for torrent_id, infohash, torrent_name, normalized_torrent_name in batch:
-            selects.append("SELECT %s AS id, %s AS infohash, %s AS name, %s AS normalized_name")
-            params.extend([torrent_id, infohash, torrent_name, normalized_torrent_name])
-
-        # assemble the union table selects into one large query
-        union_sql = " UNION ALL ".join(selects)
-
-        # create the final query to find torrents which already exist in the database
-        missing_query = f"""
-                    SELECT c.id
-                    FROM (
-                        {union_sql}
-                    ) AS c
-                    LEFT JOIN torrents t
-                      ON t.hash_v2 = c.infohash
-                    WHERE
-                        t.hash_v2 IS NULL
-                        OR (t.hash_v1 IS NULL AND t.added_by_user_id = %s)
-                """
-
-        result = await mysql.fetch_all(missing_query, params + [user.user_id])
-        missing_ids.extend(row["id"] for row in result)
+    if not valid_torrents:
+        return ORJSONResponse({"missing_ids": [t.id for t in torrents]})
 
-        # reset the name and normalized name in the database to match what the client sent us (only if they are original uploader)
-        update_query = f"""
-                    UPDATE torrents t
-                    JOIN (
-                        {union_sql}
-                    ) AS c
-                      ON c.infohash = t.hash_v2
-                    SET t.name = c.name, t.normalized_name = c.normalized_name
-                    WHERE
-                        c.name IS NOT NULL AND c.normalized_name IS NOT NULL AND t.added_by_user_id = %s
-                        AND (t.name != c.name OR t.normalized_name != c.normalized_name)
-                """
-
-        await mysql.execute(update_query, params + [user.user_id])
+    # remove invalid characters from every torrent name in one pass
+    normalized_torrent_names = utils.clean_text_filter_bulk([t.name or "" for t in valid_torrents])
+    rows = [(t.id, t.infohash, t.name[:SYNC_NAME_MAX_LENGTH] if t.name is not None else None,
+             normalized_torrent_name[:SYNC_NAME_MAX_LENGTH] if t.name else None) for t, normalized_torrent_name in zip(valid_torrents, normalized_torrent_names)]
+
+    # small syncs (typically at client startup) are answered from a single indexed lookup without the temporary table
+    if len(rows) <= SYNC_SMALL_THRESHOLD:
+        missing_ids = malformed_ids + await _sync_small(rows, user.user_id)
+        logger.channel("sync").debug(f"User '{user.user_label}' performed sync: {len(missing_ids)} missing (sent {len(torrents)})")
+        return ORJSONResponse({"missing_ids": missing_ids})
+
+    # limit how many pooled connections a single sync may occupy at once
+    semaphore = asyncio.Semaphore(SYNC_CONCURRENCY)
+
+    async def _process_batch(batch):
+        async with semaphore:
+            return await mysql.run_with_connection(_sync_batch, batch, user.user_id)
+
+    # create batches of torrents to search for in the database to reduce large queries, and process them concurrently
+    results = await asyncio.gather(*(_process_batch(batch) for batch in itertools.batched(rows, SYNC_BATCH_SIZE)))
+    missing_ids: list[int] = list(itertools.chain(malformed_ids, *results))
 
     logger.channel("sync").debug(f"User '{user.user_label}' performed sync: {len(missing_ids)} missing (sent {len(torrents)})")
 
     # reply with a list of local torrent IDs that are not currently tracked in the server database
-    return JSONResponse({"missing_ids": missing_ids})
+    return ORJSONResponse({"missing_ids": missing_ids})
@@ -1,16 +1,13 @@
 from fastapi import HTTPException, Request, APIRouter, Depends
 from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
 
 from privateindexer_server.core import logger
 from privateindexer_server.core import mysql, utils
-from privateindexer_server.core.config import SITE_NAME
 from privateindexer_server.core.jwt_helper import AccessTokenValidator
+from privateindexer_server.core.route_helper import templates
 from privateindexer_server.core.user_helper import User
 
 router = APIRouter()
-templates = Jinja2Templates(directory="/app/src/templates")
-templates.env.globals["SITE_NAME"] = SITE_NAME
 
 
 @router.get("/view/{torrent_id}", response_class=HTMLResponse)
@@ -1,4 +1,7 @@
-import datetime
+import asyncio
+import functools
+import hashlib
+import time
 from xml.sax.saxutils import escape
 
 from fastapi import Depends, Query, HTTPException, APIRouter
@@ -12,6 +15,140 @@ from privateindexer_server.core.user_helper import User
 
 router = APIRouter()
 
+# extra entities needed when escaping text placed inside a double-quoted XML attribute
+XML_ATTR_ENTITIES = {'"': "&quot;"}
+
+# configured values are XML escaped once, and braces are doubled for the ones placed inside str.format_map templates
+SITE_NAME_XML = escape(SITE_NAME, XML_ATTR_ENTITIES)
+SITE_NAME_TEMPLATE = SITE_NAME_XML.replace("{", "{{").replace("}", "}}")
+EXTERNAL_SERVER_URL_TEMPLATE = escape(EXTERNAL_SERVER_URL).replace("{", "{{").replace("}", "}}")
+
+# the capabilities only depend on static configuration so the response is built once
+CAPS_CATEGORIES_XML = "".join(f'<category id="{c["id"]}" name="{c["name"]}"/>' for c in CATEGORIES)
+CAPS_XML = f"""<?xml version="1.0" encoding="UTF-8"?>
+<caps>
+    <server version="1.0" title="{SITE_NAME_XML}"/>
+    <limits default="100" max="1000"/>
+    <categories>
+    {CAPS_CATEGORIES_XML}
+    </categories>
+    <searching>
+        <search available="yes" supportedParams="q"/>
+        <tv-search available="yes" supportedParams="q,season,ep,imdbid,tmdbid,tvdbid"/>
+        <movie-search available="yes" supportedParams="q,imdbid,tmdbid"/>
+        <music-search available="yes" supportedParams="q,artist,album"/>
+        <book-search available="no"/>
+    </searching>
+</caps>"""
+CAPS_RESPONSE = Response(content=CAPS_XML, media_type="application/xml")
+
+# templates for the torznab RSS responses and each torrent item
+RSS_TEMPLATE = f"""<?xml version="1.0" encoding="UTF-8" ?>
+<rss version="2.0" xmlns:torznab="http://torznab.com/schemas/2015/feed">
+    <channel>
+        <title>{SITE_NAME_TEMPLATE}</title>
+        {{items}}
+    </channel>
+</rss>
+"""
+SEARCH_TEMPLATE = f"""<?xml version="1.0" encoding="UTF-8" ?>
+<rss version="2.0" xmlns:torznab="http://torznab.com/schemas/2015/feed">
+    <channel>
+        <title>{SITE_NAME_TEMPLATE}</title>
+        <link>{EXTERNAL_SERVER_URL_TEMPLATE}/api</link>
+        <torznab:response offset="{{offset}}" total="{{total}}"/>
+        {{items}}
+    </channel>
+</rss>
+"""
+ITEM_TEMPLATE = """
+<item>
+    <title>{title}</title>
+    <guid isPermaLink="false">humehouse-{hash_v2}</guid>
+    <link>{grab_link}</link>
+    <comments>{view_link}</comments>
+    <enclosure url="{grab_link}" length="{size}" type="application/x-bittorrent"/>
+    <size>{size}</size>
+    <pubDate>{pub_date}</pubDate>
+    <category>{category}</category>
+    <torznab:attr name="category" value="{category}" />
+    <torznab:attr name="files" value="{files}"/>
+    <torznab:attr name="seeders" value="{seeders}"/>
+    <torznab:attr name="leechers" value="{leechers}"/>{peers_attr}
+    <torznab:attr name="grabs" value="{grabs}"/>
+    <torznab:attr name="infohash" value="{hash_v2}"/>{optional_attrs}
+</item>
+"""
+# MySQL's default ngram_token_size used by the normalized name full-text index
+NGRAM_TOKEN_SIZE = 2
+
+ITEM_OPTIONAL_ATTRS = ("imdbid", "tmdbid", "tvdbid", "season", "episode", "artist", "album")
+
+
+def render_optional_attrs(torrent_result: dict) -> str:
+    """
+    Helper to render the torznab attributes which are only present for some torrents
+    """
+    return "".join(f'\n    <torznab:attr name="{attr}" value="{escape(str(torrent_result[attr]), XML_ATTR_ENTITIES)}"/>'
+                   for attr in ITEM_OPTIONAL_ATTRS if torrent_result.get(attr))
+
+
+@functools.lru_cache(maxsize=32)
+def in_placeholders(count: int) -> str:
+    """
+    Helper to build the comma separated placeholders for an IN clause of a given size
+    """
+    return ",".join(["%s"] * count)
+
+
+async def fetch_peer_counts(results: list[dict]) -> dict[int, tuple[int, int]]:
+    """
+    Helper to fetch the seed and leech counts for every torrent result, falling back to no counts if Redis fails
+    """
+    try:
+        return await utils.get_seeders_and_leechers_bulk([torrent_result["id"] for torrent_result in results])
+    except Exception as e:
+        logger.channel("torznab").exception(f"Failed to fetch seeders/leechers from Redis: {e}")
+        return {}
+
+
+def render_items(results: list[dict], peer_counts: dict[int, tuple[int, int]], grab_link_parts: tuple[str, str], view_link_parts: tuple[str, str],
+                 include_peers: bool) -> str:
+    """
+    Helper to render every torrent result into torznab item XML in a single pass
+    """
+    # bind the per-item helpers locally so the loop avoids repeated global lookups
+    render_item = ITEM_TEMPLATE.format_map
+    format_pub_date = utils.format_pub_date
+    grab_link_prefix, grab_link_suffix = grab_link_parts
+    view_link_prefix, view_link_suffix = view_link_parts
+
+    items = []
+    for torrent_result in results:
+        seeders, leechers = peer_counts.get(torrent_result["id"], (0, 0))
+        hash_v2 = torrent_result["hash_v2"]
+
+        # feed the client URLs with the torrent hash and an access token
+        grab_link = f"{grab_link_prefix}{hash_v2}{grab_link_suffix}"
+        view_link = f"{view_link_prefix}{torrent_result['id']}{view_link_suffix}"
+        items.append(render_item({
+            "title": escape(torrent_result["name"]),
+            "hash_v2": hash_v2,
+            "grab_link": grab_link,
+            "view_link": view_link,
+            "size": torrent_result["size"],
+            "pub_date": format_pub_date(torrent_result["added_on"]),
+            "category": torrent_result["category"],
+            "files": torrent_result["files"],
+            "seeders": seeders,
+            "leechers": leechers,
+            "peers_attr": f'\n    <torznab:attr name="peers" value="{seeders + leechers}"/>' if include_peers else "",
+            "grabs": torrent_result["grabs"],
+            "optional_attrs": render_optional_attrs(torrent_result),
+        }))
+
+    return "".join(items)
+
 
 @router.get("/api")
 async def torznab_api(user: User = Depends(api_key_required), t: str = Query(...), q: str = Query(""), cat: str = Query(None), season: int = Query(None),
@@ -23,29 +160,14 @@ async def torznab_api(user: User = Depends(api_key_required), t: str = Query(...
     # the client is sending us a capabilities probe request to check what query parameters the server is capable of providing to the clients
     if t == "caps":
         logger.channel("torznab").debug(f"User '{user.user_label}' sent capability request")
-        xml = f"""<?xml version="1.0" encoding="UTF-8"?>
-        <caps>
-            <server version="1.0" title="{SITE_NAME}"/>
-            <limits default="100" max="1000"/>
-            <categories>
-            {''.join([f'<category id="{c["id"]}" name="{c["name"]}"/>' for c in CATEGORIES])}
-            </categories>
-            <searching>
-                <search available="yes" supportedParams="q"/>
-                <tv-search available="yes" supportedParams="q,season,ep,imdbid,tmdbid,tvdbid"/>
-                <movie-search available="yes" supportedParams="q,imdbid,tmdbid"/>
-                <music-search available="yes" supportedParams="q,artist,album"/>
-                <book-search available="no"/>
-            </searching>
-        </caps>"""
-        return Response(content=xml, media_type="application/xml")
+        return CAPS_RESPONSE
 
     # the client is performing a torrent query
     elif t in ["search", "tvsearch", "movie", "music"]:
-        before = datetime.datetime.now()
+        before = time.perf_counter_ns()
 
         # max out the limit to 1000 results
-        limit = min(int(limit), 1000)
+        limit = min(limit, 1000)
 
         # start a list of where clauses and parameters for the SQL query
         where_clauses = []
@@ -55,17 +177,39 @@ async def torznab_api(user: User = Depends(api_key_required), t: str = Query(...
             where_clauses.append(f"t.added_by_user_id != %s")
             where_params.append(user.user_id)
 
+        # parse the requested categories once for either query type
+        cats = [int(c) for c in cat.split(",")] if cat is not None else []
+        category_clause = f"t.category IN ({in_placeholders(len(cats))})"
+
         # generate access token to be inserted into returned torrent view and grab URLs
         view_access_token = jwt_helper.create_access_token(user.user_id, "view")
         grab_access_token = jwt_helper.create_access_token(user.user_id, "grab")
 
+        # build and XML-escape the constant parts of the torrent URLs once for all items
+        # the hex hashes and numeric IDs inserted between them never need escaping
+        grab_link_prefix = escape(f"{EXTERNAL_SERVER_URL}/api/v2/grab?infohash=")
+        grab_link_suffix = escape(f"&at={grab_access_token}")
+        view_link_prefix = escape(f"{EXTERNAL_SERVER_URL}/view/")
+        view_link_suffix = escape(f"?at={view_access_token}")
+
         # if no query is specified in a regular search, assume an RSS query is being made
         if t == "search" and (not q or q.strip() == ""):
 
+            # serve a recently built response for identical RSS polls
+            rss_cache_field = f"{user.user_id}:{cat}:{limit}:{offset}:{include_my_uploads}"
+            try:
+                cached_xml = await utils.get_rss_cache(rss_cache_field)
+            except Exception as e:
+                cached_xml = None
+                logger.channel("torznab").exception(f"Failed to fetch cached RSS feed from Redis: {e}")
+
+            if cached_xml is not None:
+                logger.channel("torznab").debug(f"User '{user.user_label}' performed RSS feed query in category {cat}: served from cache")
+                return Response(content=cached_xml, media_type="application/xml")
+
             # add category where clause
-            if cat is not None:
-                cats = [int(c) for c in cat.split(",")]
-                where_clauses.append(f"t.category IN ({",".join(["%s"] * len(cats))})")
+            if cats:
+                where_clauses.append(category_clause)
                 where_params.extend(cats)
 
             # add a default TRUE if no where clauses have been added
@@ -73,62 +217,25 @@ async def torznab_api(user: User = Depends(api_key_required), t: str = Query(...
 
             # perform a lightweight scan of just most recent torrents
             rss_query = f"SELECT * FROM torrents t WHERE {where_sql} ORDER BY added_on DESC LIMIT %s OFFSET %s"
-            query_params = tuple(where_params) + (int(limit), int(offset))
+            query_params = tuple(where_params) + (limit, offset)
             results = await mysql.fetch_all(rss_query, query_params)
 
+            # attempt to fetch the seed and leech counts from Redis to enrich the RSS response
+            peer_counts = await fetch_peer_counts(results)
+
             # assemble the full RSS query response
-            items = []
-            for torrent_result in results:
-                torrent_id = torrent_result["id"]
-
-                # attempt to fetch the seed and leech count from Redis to enrich the RSS response
-                try:
-                    seeders, leechers = await utils.get_seeders_and_leechers(torrent_id)
-                except Exception as e:
-                    seeders = leechers = 0
-                    logger.channel("torznab").exception(f"Failed to fetch seeders/leechers from Redis: {e}")
-
-                # feed the client URLs with the torrent hash and an access token
-                grab_link = f"{EXTERNAL_SERVER_URL}/api/v2/grab?infohash={torrent_result['hash_v2']}&at={grab_access_token}"
-                view_link = f"{EXTERNAL_SERVER_URL}/view/{torrent_result["id"]}?at={view_access_token}"
-                items.append(f"""
-                    <item>
-                        <title>{escape(torrent_result["name"])}</title>
-                        <guid isPermaLink="false">humehouse-{torrent_result['hash_v2']}</guid>
-                        <link>{escape(grab_link)}</link>
-                        <comments>{escape(view_link)}</comments>
-                        <enclosure url="{escape(grab_link)}" length="{torrent_result["size"]}" type="application/x-bittorrent"/>
-                        <size>{torrent_result["size"]}</size>
-                        <pubDate>{torrent_result["added_on"].strftime("%a, %d %b %Y %H:%M:%S GMT")}</pubDate>
-                        <category>{torrent_result["category"]}</category>
-                        <torznab:attr name="category" value="{torrent_result["category"]}" />
-                        <torznab:attr name="files" value="{torrent_result['files']}"/>
-                        <torznab:attr name="seeders" value="{seeders}"/>
-                        <torznab:attr name="leechers" value="{leechers}"/>
-                        <torznab:attr name="grabs" value="{torrent_result['grabs']}"/>
-                        <torznab:attr name="infohash" value="{torrent_result['hash_v2']}"/>
-                        {f"<torznab:attr name=\"imdbid\" value=\"{torrent_result["imdbid"]}\"/>" if torrent_result.get("imdbid") else ""}
-                        {f"<torznab:attr name=\"tmdbid\" value=\"{torrent_result["tmdbid"]}\"/>" if torrent_result.get("tmdbid") else ""}
-                        {f"<torznab:attr name=\"tvdbid\" value=\"{torrent_result["tvdbid"]}\"/>" if torrent_result.get("tvdbid") else ""}
-                        {f"<torznab:attr name=\"season\" value=\"{torrent_result["season"]}\"/>" if torrent_result.get("season") else ""}
-                        {f"<torznab:attr name=\"episode\" value=\"{torrent_result["episode"]}\"/>" if torrent_result.get("episode") else ""}
-                        {f"<torznab:attr name=\"artist\" value=\"{torrent_result["artist"]}\"/>" if torrent_result.get("artist") else ""}
-                        {f"<torznab:attr name=\"album\" value=\"{torrent_result["album"]}\"/>" if torrent_result.get("album") else ""}
-                    </item>
-                """)
+            items = render_items(results, peer_counts, (grab_link_prefix, grab_link_suffix), (view_link_prefix, view_link_suffix), False)
 
             # build the final XML object
-            xml = f"""<?xml version="1.0" encoding="UTF-8" ?>
-                <rss version="2.0" xmlns:torznab="http://torznab.com/schemas/2015/feed">
-                    <channel>
-                        <title>{SITE_NAME}</title>
-                        {"".join(items)}
-                    </channel>
-                </rss>
-            """
-
-            delta = datetime.datetime.now() - before
-            query_duration = f"{round(delta.total_seconds() * 1000)} ms"
+            xml = RSS_TEMPLATE.format_map({"items": items})
+
+            # cache the response for subsequent RSS polls
+            try:
+                await utils.set_rss_cache(rss_cache_field, xml)
+            except Exception as e:
+                logger.channel("torznab").exception(f"Failed to cache RSS feed in Redis: {e}")
+
+            query_duration = f"{(time.perf_counter_ns() - before) // 1_000_000} ms"
 
             logger.channel("torznab").debug(f"User '{user.user_label}' performed RSS feed query in category {cat} ({query_duration}): returned {len(results)} results")
 
@@ -137,25 +244,31 @@ async def torznab_api(user: User = Depends(api_key_required), t: str = Query(...
         # add the plain text query where clause
         if q is not None:
             # here we try to normalize the query by transliterating the unicode
-            normalized_q = f"%{utils.clean_text_filter(q)}%"
-            where_clauses.append("t.normalized_name LIKE %s")
-            where_params.append(normalized_q)
+            normalized_q = utils.clean_text_filter(q)
+
+            # search the ngram full-text index with a phrase of the query's ngrams, which matches it as a substring without a table scan
+            # queries shorter than one ngram fall back to a plain substring match
+            if len(normalized_q) >= NGRAM_TOKEN_SIZE:
+                where_clauses.append("MATCH(t.normalized_name) AGAINST (%s IN BOOLEAN MODE)")
+                where_params.append(f'"{normalized_q}"')
+            else:
+                where_clauses.append("t.normalized_name LIKE %s")
+                where_params.append(f"%{normalized_q}%")
 
         # add category where clause
-        if cat is not None:
-            cats = [int(c) for c in cat.split(",")]
-            where_clauses.append(f"t.category IN ({",".join(["%s"] * len(cats))})")
+        if cats:
+            where_clauses.append(category_clause)
             where_params.extend(cats)
 
         # add TV-related where clauses
         if t == "tvsearch":
             if season is not None:
                 where_clauses.append("t.season = %s")
-                where_params.append(int(season))
+                where_params.append(season)
 
                 if ep is not None:
                     where_clauses.append("t.episode = %s")
-                    where_params.append(int(ep))
+                    where_params.append(ep)
                 else:
                     where_clauses.append("t.episode IS NULL")
             where_clauses.append("t.artist IS NULL")
@@ -206,20 +319,38 @@ async def torznab_api(user: User = Depends(api_key_required), t: str = Query(...
 
         # assemble the final query
         query = f"""
-            SELECT *, COUNT(*) OVER() AS total_matches
+            SELECT *
             FROM torrents t
             WHERE {where_sql}
             ORDER BY added_on DESC
             LIMIT %s OFFSET %s
         """
 
-        # time and execute the query
-        query_params = tuple(where_params) + (int(limit), int(offset))
-        results = await mysql.fetch_all(query, query_params)
-        total_matches = results[0]["total_matches"] if results else 0
+        # assemble a separate query to count all matches without a window over every row
+        count_query = f"SELECT COUNT(*) AS total_matches FROM torrents t WHERE {where_sql}"
 
-        delta = datetime.datetime.now() - before
-        query_duration = f"{round(delta.total_seconds() * 1000)} ms"
+        # reuse a recent match total for identical searches since paging clients repeat the same where clause, keyed by a fixed-length digest of it
+        count_cache_field = hashlib.blake2b(f"{where_sql}|{where_params}".encode(), digest_size=16).hexdigest()
+        try:
+            total_matches = await utils.get_search_count_cache(count_cache_field)
+        except Exception as e:
+            total_matches = None
+            logger.channel("torznab").exception(f"Failed to fetch cached search total from Redis: {e}")
+
+        # time and execute the queries, counting concurrently when there is no cached total
+        query_params = tuple(where_params) + (limit, offset)
+        if total_matches is None:
+            results, count_result = await asyncio.gather(mysql.fetch_all(query, query_params), mysql.fetch_one(count_query, tuple(where_params)))
+            total_matches = count_result["total_matches"] if count_result else 0
+
+            try:
+                await utils.set_search_count_cache(count_cache_field, total_matches)
+            except Exception as e:
+                logger.channel("torznab").exception(f"Failed to cache search total in Redis: {e}")
+        else:
+            results = await mysql.fetch_all(query, query_params)
+
+        query_duration = f"{(time.perf_counter_ns() - before) // 1_000_000} ms"
 
         # reassemble the full request string for logging
         search_params = {"cat": cat, "season": season, "ep": ep, "imdbid": imdbid, "tmdbid": tmdbid, "tvdbid": tvdbid, "artist": artist, "album": album}
@@ -227,61 +358,12 @@ async def torznab_api(user: User = Depends(api_key_required), t: str = Query(...
         logger.channel("torznab").info(f"User '{user.user_label}' searched{f" '{q}'" if q else ""} with params {search_params} ({query_duration}): "
                                        f"returned {len(results)} results, found {total_matches} total")
 
-        # assemble the full query response
-        items = []
-        for torrent_result in results:
-            torrent_id = torrent_result["id"]
+        # attempt to fetch the seed and leech counts from Redis to enrich the query response
+        peer_counts = await fetch_peer_counts(results)
 
-            # attempt to fetch the seed and leech count from Redis to enrich the query response
-            try:
-                seeders, leechers = await utils.get_seeders_and_leechers(torrent_id)
-            except Exception as e:
-                seeders = leechers = 0
-                logger.channel("torznab").exception(f"Failed to fetch seeders/leechers from Redis: {e}")
-
-            # feed the client URLs with the torrent hash and an access token
-            grab_link = f"{EXTERNAL_SERVER_URL}/api/v2/grab?infohash={torrent_result['hash_v2']}&at={grab_access_token}"
-            view_link = f"{EXTERNAL_SERVER_URL}/view/{torrent_result["id"]}?at={view_access_token}"
-            item = f"""
-            <item>
-                <title>{escape(torrent_result["name"])}</title>
-                <guid isPermaLink="false">humehouse-{torrent_result['hash_v2']}</guid>
-                <link>{escape(grab_link)}</link>
-                <comments>{escape(view_link)}</comments>
-                <enclosure url="{escape(grab_link)}" length="{torrent_result["size"]}" type="application/x-bittorrent"/>
-                <size>{torrent_result["size"]}</size>
-                <pubDate>{torrent_result["added_on"].strftime("%a, %d %b %Y %H:%M:%S GMT")}</pubDate>
-                <category>{torrent_result["category"]}</category>
-                <torznab:attr name="category" value="{torrent_result["category"]}" />
-                <torznab:attr name="files" value="{torrent_result['files']}"/>
-                <torznab:attr name="seeders" value="{seeders}"/>
-                <torznab:attr name="leechers" value="{leechers}"/>
-                <torznab:attr name="peers" value="{seeders + leechers}"/>
-                <torznab:attr name="grabs" value="{torrent_result['grabs']}"/>
-                <torznab:attr name="infohash" value="{torrent_result['hash_v2']}"/>
-                {f"<torznab:attr name=\"imdbid\" value=\"{torrent_result["imdbid"]}\"/>" if torrent_result.get("imdbid") else ""}
-                {f"<torznab:attr name=\"tmdbid\" value=\"{torrent_result["tmdbid"]}\"/>" if torrent_result.get("tmdbid") else ""}
-                {f"<torznab:attr name=\"tvdbid\" value=\"{torrent_result["tvdbid"]}\"/>" if torrent_result.get("tvdbid") else ""}
-                {f"<torznab:attr name=\"season\" value=\"{torrent_result["season"]}\"/>" if torrent_result.get("season") else ""}
-                {f"<torznab:attr name=\"episode\" value=\"{torrent_result["episode"]}\"/>" if torrent_result.get("episode") else ""}
-                {f"<torznab:attr name=\"artist\" value=\"{torrent_result["artist"]}\"/>" if torrent_result.get("artist") else ""}
-                {f"<torznab:attr name=\"album\" value=\"{torrent_result["album"]}\"/>" if torrent_result.get("album") else ""}
-            </item>
-            """
-            items.append(item)
-
-        # build the final XML object
-        xml = f"""<?xml version="1.0" encoding="UTF-8" ?>
-            <rss version="2.0" xmlns:torznab="http://torznab.com/schemas/2015/feed">
-                <channel>
-                    <title>{SITE_NAME}</title>
-                    <link>{EXTERNAL_SERVER_URL}/api</link>
-                    <torznab:response offset="{offset}" total="{total_matches}"/>
-                    {"".join(items)}
-                </channel>
-            </rss>
-        """
-        return Response(content=xml, media_type="application/xml")
+        # render the whole response up front since it is bounded by the limit, keeping the content length for analytics and failing with a proper error
+        items = render_items(results, peer_counts, (grab_link_prefix, grab_link_suffix), (view_link_prefix, view_link_suffix), True)
+        return Response(content=SEARCH_TEMPLATE.format_map({"offset": offset, "total": total_matches, "items": items}), media_type="application/xml")
 
     # the user is performing an unknown or unsupported query type
     else:
@@ -1,7 +1,13 @@
 import secrets
+import time
 
 from privateindexer_server.core import mysql
 
+# users looked up by API key are reused for a short time since clients authenticate on every request
+USER_CACHE_TTL = 60
+USER_CACHE_MAX_SIZE = 10_000
+_user_cache: dict[str, tuple[float, "User"]] = {}
+
 
 class User:
     """
@@ -27,6 +33,11 @@ async def get_user(api_key: str = None, user_id: int = None) -> User | None:
     """
 
     if api_key:
+        # serve a recent lookup for this key without a database round-trip
+        cached = _user_cache.get(api_key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
         where_clause = "WHERE api_key = %s"
         where_params = (api_key,)
     elif user_id:
@@ -40,7 +51,21 @@ async def get_user(api_key: str = None, user_id: int = None) -> User | None:
     if not row:
         return None
 
-    return User(row["id"], row["label"], row["api_key"], row["downloaded"], row["uploaded"])
+    user = User(row["id"], row["label"], row["api_key"], row["downloaded"], row["uploaded"])
+
+    if api_key:
+        if len(_user_cache) >= USER_CACHE_MAX_SIZE:
+            _user_cache.clear()
+        _user_cache[api_key] = (time.monotonic() + USER_CACHE_TTL, user)
+
+    return user
+
+
+def invalidate_user_cache():
+    """
+    Drop all cached API key lookups so label, key, and deletion changes take effect immediately
+    """
+    _user_cache.clear()
 
 
 async def get_users() -> list[dict]:
@@ -77,6 +102,8 @@ async def update_user(user_id: int, user_label: str = None, rotate_key: bool = F
     if user_label is not None:
         await mysql.execute("UPDATE users SET label = %s WHERE id = %s", (user_label, user_id,))
 
+    invalidate_user_cache()
+
 
 async def delete_user(user_id: int):
     """
@@ -84,3 +111,5 @@ async def delete_user(user_id: int):
     """
 
     await mysql.execute("DELETE FROM users WHERE id = %s", (user_id,))
+
+    invalidate_user_cache()
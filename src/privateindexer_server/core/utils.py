@@ -1,6 +1,9 @@
+import asyncio
+import errno
 import os
 import re
 import time
+from collections import OrderedDict
 from datetime import datetime, timezone
 from decimal import Decimal
 from urllib.parse import unquote_to_bytes
@@ -10,28 +13,173 @@ from unidecode import unidecode
 
 from privateindexer_server.core import logger
 from privateindexer_server.core import redis
-from privateindexer_server.core.config import TORRENTS_DIR, CATEGORIES, PEER_TIMEOUT
+from privateindexer_server.core.config import TORRENTS_DIR, CATEGORY_NAMES, PEER_TIMEOUT, REDIS_SCAN_COUNT, RSS_CACHE_TTL
+
+# length of the fixed "peer:" prefix of peer hash keys
+PEER_KEY_PREFIX_LENGTH = len("peer:")
+
+_torrents_dir_fd: int | None = None
+
+WEEKDAY_NAMES = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+MONTH_NAMES = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+# number of recent request times kept in Redis for the analytics min/max/average
+REQUEST_TIMES_WINDOW = 1000
+# number of request times collected in memory before they are written to Redis together
+REQUEST_TIMES_BATCH_SIZE = 100
+
+# Redis hash of recently built torznab RSS responses, dropped as a whole when torrents change
+RSS_CACHE_KEY = "torznab:rss"
+
+# Redis hash of recent torznab search match totals keyed by their where clause, dropped together with the RSS cache
+SEARCH_COUNT_CACHE_KEY = "torznab:counts"
+
+# recently cleaned strings keyed by their original text
+CLEAN_TEXT_CACHE_SIZE = 131072
+_clean_text_cache: OrderedDict[str, str] = OrderedDict()
+
+# every byte except lowercase letters and digits, deleted from transliterated text with bytes.translate
+NON_ALPHANUMERIC_BYTES = bytes(c for c in range(256) if not (ord("a") <= c <= ord("z") or ord("0") <= c <= ord("9")))
+
+# same as above but keeps the NUL separator (the first byte) used to clean many strings in one pass
+NON_ALPHANUMERIC_OR_SEPARATOR_BYTES = NON_ALPHANUMERIC_BYTES[1:]
+
+NON_DIGIT_REGEX = re.compile(r"\D")
+
+INFOHASH_V2_REGEX = re.compile(r"[0-9a-fA-F]{64}")
 
 SEASON_EPISODE_REGEX = re.compile(r"S(?P<season>\d{1,4})(?:E(?P<episode>\d{1,3}))?|(?P<season_alt>\d{1,4})x(?P<episode_alt>\d{1,3})", re.IGNORECASE, )
 
 
+def get_torrent_filename(hash_v2: str) -> str:
+    """
+    Helper to concatenate torrent v2 hash and torrent extension
+    """
+    return f"{hash_v2}.torrent"
+
+
 def get_torrent_file(hash_v2: str) -> str:
     """
     Helper to concatenate torrents directory, torrent v2 hash, and torrent extension
     """
-    return os.path.join(TORRENTS_DIR, f"{hash_v2}.torrent")
+    return os.path.join(TORRENTS_DIR, get_torrent_filename(hash_v2))
+
+
+def get_torrents_dir_fd() -> int:
+    """
+    Helper to lazily open a long-lived descriptor for the torrents directory so stored files skip resolving its path
+    """
+    global _torrents_dir_fd
+    if _torrents_dir_fd is None:
+        _torrents_dir_fd = os.open(TORRENTS_DIR, os.O_RDONLY | os.O_DIRECTORY)
+    return _torrents_dir_fd
+
+
+def _copy_file(source: str, destination: str, destination_dir_fd: int | None = None):
+    """
+    Helper to copy a file inside the kernel in 1 MiB chunks without buffering it in Python, removing the partial copy on failure
+    """
+    source_fd = os.open(source, os.O_RDONLY)
+    try:
+        destination_fd = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644, dir_fd=destination_dir_fd)
+        try:
+            try:
+                while os.copy_file_range(source_fd, destination_fd, 1 << 20):
+                    pass
+            except OSError as e:
+                # copy_file_range refuses to cross filesystems on newer kernels, so start over with sendfile which has no such restriction
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL):
+                    raise
+                os.lseek(destination_fd, 0, os.SEEK_SET)
+                os.ftruncate(destination_fd, 0)
+                offset = 0
+                while sent := os.sendfile(destination_fd, source_fd, offset, 1 << 20):
+                    offset += sent
+        except Exception:
+            # never leave a truncated torrent file behind in the destination directory
+            os.unlink(destination, dir_fd=destination_dir_fd)
+            raise
+        finally:
+            os.close(destination_fd)
+    finally:
+        os.close(source_fd)
+
+
+async def move_file(source: str, destination: str, destination_dir_fd: int | None = None):
+    """
+    Helper to move a file off the event loop, falling back to a kernel-side copy across filesystems
+    """
+    try:
+        await asyncio.to_thread(os.rename, source, destination, dst_dir_fd=destination_dir_fd)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+        # source and destination are on different filesystems so copy the data then remove the original
+        await asyncio.to_thread(_copy_file, source, destination, destination_dir_fd)
+        await asyncio.to_thread(os.unlink, source)
+
+
+def _cache_clean_text(text: str, cleaned: str):
+    """
+    Helper to remember a cleaned string, evicting the least recently used entry once the cache is full
+    """
+    _clean_text_cache[text] = cleaned
+    if len(_clean_text_cache) > CLEAN_TEXT_CACHE_SIZE:
+        _clean_text_cache.popitem(last=False)
 
 
 def clean_text_filter(text: str) -> str:
     """
     Helper to transliterate or remove invalid characters from text
     """
+    # clients re-send the same names on every sync, so reuse recent results
+    cleaned = _clean_text_cache.get(text)
+    if cleaned is not None:
+        _clean_text_cache.move_to_end(text)
+        return cleaned
+
     # transliterate
-    text = unidecode(text, replace_str="")
-    text = text.lower().strip()
+    cleaned = unidecode(text, replace_str="")
+    cleaned = cleaned.lower()
+
+    # transliterated text is plain ASCII, so delete non-standard characters with a C-level byte translation
+    cleaned = cleaned.encode("ascii", "ignore").translate(None, NON_ALPHANUMERIC_BYTES).decode("ascii")
+    _cache_clean_text(text, cleaned)
+    return cleaned
+
+
+def clean_text_filter_bulk(texts: list[str]) -> list[str]:
+    """
+    Helper to apply clean_text_filter to many strings with a single transliteration and byte translate pass
+    """
+    # reuse cached results and collect only the strings which still need cleaning
+    results = []
+    uncached = []
+    for text in texts:
+        cleaned = _clean_text_cache.get(text)
+        if cleaned is None:
+            uncached.append(text)
+        else:
+            _clean_text_cache.move_to_end(text)
+        results.append(cleaned)
+
+    if not uncached:
+        return results
+
+    # join on NUL so the whole batch is transliterated, lowered, and filtered at once, then split back apart
+    joined = unidecode("\x00".join(uncached), replace_str="").lower()
+    cleaned_uncached = joined.encode("ascii", "ignore").translate(None, NON_ALPHANUMERIC_OR_SEPARATOR_BYTES).decode("ascii").split("\x00")
 
-    # use a regex replacement to remove non-standard characters
-    return re.sub(r"[^a-z0-9]+", "", text)
+    # fall back to per-string cleaning if any input contained the separator itself
+    if len(cleaned_uncached) != len(uncached):
+        return [clean_text_filter(text) for text in texts]
+
+    cleaned_lookup = dict(zip(uncached, cleaned_uncached))
+    for text, cleaned in cleaned_lookup.items():
+        _cache_clean_text(text, cleaned)
+
+    return [cleaned_lookup[text] if cleaned is None else cleaned for text, cleaned in zip(texts, results)]
 
 
 def extract_bt_param(raw_qs: bytes, key: str) -> bytes:
@@ -69,7 +217,7 @@ def get_category_name(category_id: int) -> str | None:
     """
     Fetch a category name based on ID
     """
-    return {category["id"]: category["name"] for category in CATEGORIES}.get(category_id)
+    return CATEGORY_NAMES.get(category_id)
 
 
 def format_bytes(num_bytes: int) -> str:
@@ -85,6 +233,14 @@ def format_bytes(num_bytes: int) -> str:
     return f"{num_bytes / (1024 ** 3):.2f} GiB"
 
 
+def format_pub_date(dt: datetime) -> str:
+    """
+    Format a datetime as an RFC 1123 date for RSS without the locale-aware strftime
+    """
+    return (f"{WEEKDAY_NAMES[dt.weekday()]}, {dt.day:02d} {MONTH_NAMES[dt.month - 1]} {dt.year} "
+            f"{dt.hour:02d}:{dt.minute:02d}:{dt.second:02d} GMT")
+
+
 def time_ago(dt: datetime) -> str:
     """
     Convert a datetime to a human-readable 'x(value) y(unit) ago' format for time deltas
@@ -117,17 +273,16 @@ def time_ago(dt: datetime) -> str:
     return f"on {dt.strftime('%Y-%m-%d')}"
 
 
-def get_torrent_hashes(torrent_file: str) -> tuple[str, str]:
+def get_torrent_hashes(info: lt.torrent_info) -> tuple[str, str]:
     """
-    Decode the hash v1 and v2 from the torrent info of a torrent file
+    Decode the hash v1 and v2 from already parsed torrent info
     """
     try:
-        info = lt.torrent_info(torrent_file)
         hashes = info.info_hashes()
 
         return str(hashes.v1).lower(), str(hashes.v2).lower()
     except Exception as e:
-        logger.channel("torrent").exception(f"Error getting hashes for '{torrent_file}': {e}")
+        logger.channel("torrent").exception(f"Error getting hashes for '{info.name()}': {e}")
         return "", ""
 
 
@@ -147,20 +302,179 @@ async def get_seeders_and_leechers(torrent_id: int) -> tuple[int, int]:
     """
     Fetch seeders and leechers from Redis database for a torrent
     """
+    # reuse the pipelined bulk lookup so a single torrent costs two round-trips rather than one per peer
+    return (await get_seeders_and_leechers_bulk([torrent_id]))[torrent_id]
+
+
+async def get_seeders_and_leechers_bulk(torrent_ids: list[int]) -> dict[int, tuple[int, int]]:
+    """
+    Fetch seeders and leechers from Redis database for many torrents using pipelined round-trips
+    """
+    if not torrent_ids:
+        return {}
+
     redis_conn = redis.get_connection()
     now = int(time.time())
     cutoff = now - PEER_TIMEOUT
 
-    seeders = leechers = 0
-
-    peer_ids = await redis_conn.zrangebyscore(f"peers:{torrent_id}", min=cutoff, max=now)
-    for pid in peer_ids:
-        pdata = await redis_conn.hgetall(f"peer:{torrent_id}:{pid}")
+    # fetch the active peer IDs for every torrent in one round-trip, these reads do not need a MULTI/EXEC transaction
+    pipe = redis_conn.pipeline(transaction=False)
+    for torrent_id in torrent_ids:
+        await pipe.zrangebyscore(f"peers:{torrent_id}", min=cutoff, max=now)
+    all_peer_ids = await pipe.execute()
+
+    # fetch the peer data for every active peer in a second round-trip
+    pipe = redis_conn.pipeline(transaction=False)
+    peer_torrent_ids = []
+    for torrent_id, peer_ids in zip(torrent_ids, all_peer_ids):
+        for pid in peer_ids:
+            await pipe.hgetall(f"peer:{torrent_id}:{pid}")
+            peer_torrent_ids.append(torrent_id)
+    all_peers_data = await pipe.execute() if peer_torrent_ids else []
+
+    counts = {torrent_id: [0, 0] for torrent_id in torrent_ids}
+    for torrent_id, pdata in zip(peer_torrent_ids, all_peers_data):
         if not pdata:
             continue
         if int(pdata.get("left", 1)) == 0:
-            seeders += 1
+            counts[torrent_id][0] += 1
+        else:
+            counts[torrent_id][1] += 1
+
+    return {torrent_id: (seeders, leechers) for torrent_id, [seeders, leechers] in counts.items()}
+
+
+async def get_peer_totals() -> tuple[int, int, int]:
+    """
+    Count the total peers along with the number of torrents which have seeders and which have leechers
+    """
+    total_peers = 0
+    seeding_torrents = set()
+    leeching_torrents = set()
+    async for peer_key, (left,) in scan_peer_fields("left"):
+        # keys are "peer:{torrent_id}:{peer_id}", so slice the torrent ID after the fixed prefix instead of splitting the whole key
+        separator = peer_key.find(":", PEER_KEY_PREFIX_LENGTH)
+        if separator < 0:
+            continue
+        torrent_id = int(peer_key[PEER_KEY_PREFIX_LENGTH:separator])
+
+        # peers without a known amount left are counted as leechers
+        if left is not None and int(left) == 0:
+            seeding_torrents.add(torrent_id)
         else:
-            leechers += 1
+            leeching_torrents.add(torrent_id)
+        total_peers += 1
+
+    return total_peers, len(seeding_torrents), len(leeching_torrents)
+
+
+async def scan_peer_fields(*fields: str):
+    """
+    Generator to walk every peer hash with a SCAN cursor, fetching the requested fields with one pipeline per page
+    """
+    redis_connection = redis.get_connection()
+
+    # page through the keyspace client-side so Redis can serve announces between pages instead of blocking on one long script
+    cursor = 0
+    while True:
+        cursor, peer_keys = await redis_connection.scan(cursor=cursor, match="peer:*:*", count=REDIS_SCAN_COUNT)
+        if peer_keys:
+            pipe = redis_connection.pipeline(transaction=False)
+            for peer_key in peer_keys:
+                await pipe.hmget(peer_key, *fields)
+            for peer_key, peer_values in zip(peer_keys, await pipe.execute()):
+                yield peer_key, peer_values
+
+        if cursor == 0:
+            break
+
+
+async def get_user_peer_stats() -> dict[int, tuple[int, int]]:
+    """
+    Count the seeding and leeching peers for each user
+    """
+    stats = {}
+    async for _, (user_id, left) in scan_peer_fields("user_id", "left"):
+        # skip invalid peer data, including peers which expired while scanning
+        try:
+            user_id = int(user_id)
+            left = int(left)
+        except (TypeError, ValueError):
+            continue
+
+        seeding, leeching = stats.get(user_id, (0, 0))
+        if left == 0:
+            stats[user_id] = (seeding + 1, leeching)
+        else:
+            stats[user_id] = (seeding, leeching + 1)
+
+    return stats
+
+
+async def check_reachable(ip_address: str, port: int, timeout: float = 5) -> bool:
+    """
+    Check if a TCP connection can be opened to the IP and port without blocking the event loop
+    """
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip_address, port), timeout=timeout)
+    except (asyncio.TimeoutError, OSError):
+        return False
 
-    return seeders, leechers
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+
+    return True
+
+
+async def get_rss_cache(field: str) -> str | None:
+    """
+    Fetch a cached torznab RSS response from Redis
+    """
+    return await redis.get_connection().hget(RSS_CACHE_KEY, field)
+
+
+async def _set_cache_field(key: str, field: str, value: str | int):
+    """
+    Helper to store a field in a cache hash, expiring the whole hash RSS_CACHE_TTL seconds after its first entry
+    """
+    redis_connection = redis.get_connection()
+
+    # only start the expiry when the hash has none yet, checked by hand since EXPIRE NX needs Redis 7
+    pipe = redis_connection.pipeline()
+    await pipe.hset(key, field, value)
+    await pipe.ttl(key)
+    _, ttl = await pipe.execute()
+    if ttl < 0:
+        await redis_connection.expire(key, RSS_CACHE_TTL)
+
+
+async def set_rss_cache(field: str, xml: str):
+    """
+    Store a torznab RSS response in Redis
+    """
+    await _set_cache_field(RSS_CACHE_KEY, field, xml)
+
+
+async def get_search_count_cache(field: str) -> int | None:
+    """
+    Fetch a cached torznab search match total from Redis
+    """
+    total = await redis.get_connection().hget(SEARCH_COUNT_CACHE_KEY, field)
+    return int(total) if total is not None else None
+
+
+async def set_search_count_cache(field: str, total: int):
+    """
+    Store a torznab search match total in Redis
+    """
+    await _set_cache_field(SEARCH_COUNT_CACHE_KEY, field, total)
+
+
+async def invalidate_rss_cache():
+    """
+    Drop all cached torznab RSS responses and search match totals
+    """
+    await redis.get_connection().delete(RSS_CACHE_KEY, SEARCH_COUNT_CACHE_KEY)
@@ -6,7 +6,8 @@ from fastapi import FastAPI, Request, Response
 from fastapi.staticfiles import StaticFiles
 
 from privateindexer_server.core import logger
-from privateindexer_server.core import mysql, database_check, stale_check, redis, peer_timeout, stats_update, jwt_helper, route_helper, client_check, config
+from privateindexer_server.core import mysql, database_check, stale_check, redis, peer_timeout, stats_update, jwt_helper, route_helper, client_check, config, \
+    admin_helper, grab_flush, utils
 from privateindexer_server.core.config import HIGH_LATECY_THRESHOLD, APP_VERSION
 from privateindexer_server.core.routes import gui, admin, torznab, api_v2
 
@@ -23,6 +24,10 @@ async def lifespan(_: FastAPI):
         logger.channel("app").exception(f"Exception while reading/creating JWT key: {e}")
         exit(1)
 
+    # load the admin password hash into memory and measure the hashing time for the configured bcrypt cost
+    admin_helper.get_admin_password()
+    admin_helper.benchmark_bcrypt_cost()
+
     # test Redis connection
     try:
         await redis.get_connection()
@@ -48,6 +53,7 @@ async def lifespan(_: FastAPI):
         asyncio.create_task(peer_timeout.periodic_peer_timeout_task()),
         asyncio.create_task(stats_update.periodic_stats_update_task()),
         asyncio.create_task(client_check.periodic_client_check_task()),
+        asyncio.create_task(grab_flush.periodic_grab_flush_task()),
     ]
 
     logger.channel("app").info("API server started on 0.0.0.0:8081")
@@ -81,6 +87,9 @@ app.include_router(admin.router)
 app.include_router(torznab.router)
 app.include_router(api_v2.router)
 
+# request times waiting to be written to Redis in one batch
+_pending_request_times: list[str] = []
+
 
 @app.middleware("http")
 async def track_stats(request: Request, call_next):
@@ -123,6 +132,13 @@ async def track_stats(request: Request, call_next):
     if response.headers.get("content-length"):
         await pipe.incrby("stats:bytes_sent", int(response.headers["content-length"]))
 
+    # keep a rolling window of the most recent request times for analytics, only writing them once a full batch has been collected
+    _pending_request_times.append(f"{duration:.3f}")
+    if len(_pending_request_times) >= utils.REQUEST_TIMES_BATCH_SIZE:
+        await pipe.rpush("stats:request_times", *_pending_request_times)
+        await pipe.ltrim("stats:request_times", -utils.REQUEST_TIMES_WINDOW, -1)
+        _pending_request_times.clear()
+
     # complete the redis transation
     await pipe.execute()
 